@@ -0,0 +1,304 @@
+# -*- coding: utf-8 *-*
+"""Throughput benchmarks for the simulation, sensors and protocol.
+
+Every benchmark sets up its world from fixed seeds, so runs are comparable.
+Results are compared against the numbers stored in baseline.json:
+
+    python -m benchmarks.bench              # run and compare
+    python -m benchmarks.bench -k sensor    # only benchmarks matching
+    python -m benchmarks.bench --save       # store the results as baseline
+
+The exit status is 1 when something got slower than the threshold.
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+from optparse import OptionParser
+from timeit import default_timer
+
+import numpy
+from twisted.test.proto_helpers import StringTransport
+
+from spacecraft import codec, map, recording, server, world
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, 'baseline.json')
+BOTS = os.path.join(HERE, os.pardir, 'bots')
+MAPS = os.path.join(HERE, os.pardir, 'maps')
+
+benchmarks = []
+
+
+def benchmark(name):
+    """Registers a setup function, which returns the callable to time."""
+    def register(setup):
+        benchmarks.append((name, setup))
+        return setup
+    return register
+
+
+class Skip(Exception):
+    """Raised by a setup when the benchmark can't run here."""
+
+
+def seed():
+    random.seed(1234)
+    numpy.random.seed(1234)
+
+
+def crowded_game(players, bullets=0, size=None):
+    """A running game with players and bullets spread around the map."""
+    if size is None:
+        # keep the density about the same whatever the count
+        size = int(20 * (players + bullets) ** 0.5) + 50
+    game = world.Game(size, size, start=True)
+    ships = [world.PlayerObject(game) for i in range(players)]
+    for ship in ships:
+        ship.body.linearVelocity = numpy.random.uniform(-20, 20, 2).tolist()
+    for i in range(bullets):
+        x, y = numpy.random.uniform(0, size, 2)
+        speedx, speedy = numpy.random.uniform(-50, 50, 2)
+        game.projectiles.spawn(world.Bullet, x, y, speedx, speedy)
+    return game, ships
+
+
+def step_world(bodies):
+    def setup():
+        game, ships = crowded_game(bodies)
+        return game.step_world
+    return setup
+
+for count in (50, 200, 800):
+    benchmark('step_world[%i players]' % count)(step_world(count))
+
+
+@benchmark('PlayerObject.execute[64 players]')
+def execute():
+    game, ships = crowded_game(64)
+
+    def tick():
+        for ship in ships:
+            ship.throttle = 1
+            ship.turn = 0.1
+            ship.execute()
+        # keep the bodies from building up momentum
+        game.world.ClearForces()
+    return tick
+
+
+@benchmark('ProximityMine.contact[50 shrapnel]')
+def mine():
+    game, ships = crowded_game(16, bullets=200)
+
+    def tick():
+        mine = world.ProximityMine(game)
+        mine.contact(ships[0])
+        # the shrapnel goes away, like it would after hitting something
+        for projectile in game.projectiles:
+            if isinstance(projectile, world.Shrapnel):
+                projectile.destroy()
+        game.projectiles.execute()
+        mine.destroy()
+    return tick
+
+
+def sensor(sensor_class):
+    def setup():
+        game, ships = crowded_game(64, bullets=200)
+        sensors = [sensor_class(ship) for ship in ships]
+
+        def tick():
+            # readings share per tick work, so start each run afresh
+            game.tick_cache = {}
+            for each in sensors:
+                each.getReadings()
+        return tick
+    return setup
+
+for sensor_class in (world.GpsSensor, world.StatusSensor,
+        world.ProximitySensor, world.RadarSensor):
+    benchmark('getReadings[%s, 64 players]' % sensor_class.name)(
+        sensor(sensor_class))
+
+
+
+@benchmark('getReadings[all sensors, 64 players]')
+def all_sensors():
+    game, ships = crowded_game(64, bullets=200)
+    for ship in ships:
+        ship.sensors.append(world.RadarSensor(ship))
+
+    def tick():
+        game.tick_cache = {}
+        for ship in ships:
+            ship.getReadings()
+    return tick
+
+
+def monitor_update(bodies, codec_name, mode):
+    def setup():
+        if codec_name not in codec.codecs:
+            raise Skip('no %s codec' % codec_name)
+        game, ships = crowded_game(bodies)
+        monitor = server.Monitor()
+        monitor.map = game
+        monitor.transport = StringTransport()
+        monitor.codec = codec.codecs[codec_name]
+        monitor.mode = mode
+
+        def tick():
+            game.ticks += 1
+            game.tick_cache = {}
+            monitor.transport.clear()
+            monitor.sendUpdate()
+        return tick
+    return setup
+
+for count in (100, 1000):
+    for codec_name, mode in (('json', 'full'), ('binary', 'full'),
+            ('json', 'delta')):
+        benchmark('Monitor.sendUpdate[%i bodies, %s, %s]' % (
+            count, codec_name, mode))(monitor_update(count, codec_name, mode))
+
+
+@benchmark('Recorder.record_tick[1000 bodies]')
+def record_tick():
+    game, ships = crowded_game(1000)
+    recorder = recording.Recorder(game, open(os.devnull, 'wb'))
+
+    def tick():
+        game.ticks += 1
+        game.tick_cache = {}
+        recorder.record_tick()
+    return tick
+
+
+@benchmark('MapLoader.setup_map[2000 walls]')
+def setup_map():
+    handle, path = tempfile.mkstemp(suffix='.svg')
+    with os.fdopen(handle, 'w') as svg:
+        svg.write('<svg xmlns="http://www.w3.org/2000/svg">\n')
+        for x, y in numpy.random.uniform(0, 3000, (2000, 2)):
+            svg.write('<g transform="translate(1,2)"><rect x="%f" y="%f" '
+                'width="5" height="7" /></g>\n' % (x, y))
+        svg.write('</svg>\n')
+    loader = map.MapLoader(path)
+    os.remove(path)
+    return lambda: loader.setup_map(world.Game(3000, 3000))
+
+
+@benchmark('GridMap.find_path[cross.svg]')
+def find_path():
+    sys.path.append(BOTS)
+    try:
+        import maptools
+    except ImportError, e:
+        raise Skip(str(e))
+    grid = maptools.GridMap(os.path.join(MAPS, 'cross.svg'))
+    return lambda: grid.find_path((3, 3), (47, 47))
+
+
+def measure(func, repeat=5, min_time=0.1):
+    """Seconds per call, the best of repeat runs of at least min_time."""
+    number = 1
+    while True:
+        start = default_timer()
+        for i in xrange(number):
+            func()
+        elapsed = default_timer() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed / number
+    for i in range(repeat - 1):
+        start = default_timer()
+        for i in xrange(number):
+            func()
+        best = min(best, (default_timer() - start) / number)
+    return best
+
+
+def run(pattern=''):
+    """Returns {name: seconds per call or None if skipped}."""
+    results = {}
+    for name, setup in benchmarks:
+        if pattern not in name:
+            continue
+        seed()
+        try:
+            func = setup()
+        except Skip, e:
+            print '%-50s skipped: %s' % (name, e)
+            results[name] = None
+            continue
+        results[name] = measure(func)
+        print '%-50s %10.3f ms' % (name, results[name] * 1000)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints how results changed from baseline, returns the regressions."""
+    regressions = []
+    print
+    print '%-50s %10s %10s %7s' % ('benchmark', 'baseline', 'now', 'ratio')
+    for name, setup in benchmarks:
+        if name not in results:
+            continue
+        now, before = results[name], baseline.get(name)
+        if now is None or before is None:
+            print '%-50s %10s %10s' % (name, fmt(before), fmt(now))
+            continue
+        ratio = now / before
+        note = ''
+        if ratio > 1 + threshold:
+            note = 'SLOWER'
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            note = 'faster'
+        print '%-50s %10s %10s %6.2fx %s' % (name, fmt(before), fmt(now),
+            ratio, note)
+    return regressions
+
+
+def fmt(seconds):
+    if seconds is None:
+        return '-'
+    return '%.3fms' % (seconds * 1000)
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option("-k", "--pattern", default='',
+                      help="Only run the benchmarks with this in the name.")
+    parser.add_option("-b", "--baseline", default=BASELINE,
+                      help="Compare against this file.")
+    parser.add_option("-t", "--threshold", type="float", default=0.25,
+                      help="How much slower counts as a regression, "
+                      "0.25 is 25%.")
+    parser.add_option("--save", action="store_true", default=False,
+                      help="Store the results in the baseline file.")
+    (options, args) = parser.parse_args()
+
+    results = run(options.pattern)
+    if options.save:
+        baseline = {}
+        if os.path.exists(options.baseline):
+            with open(options.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(options.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return
+    if not os.path.exists(options.baseline):
+        print 'No baseline to compare with, run with --save to create one.'
+        return
+    with open(options.baseline) as f:
+        baseline = json.load(f)
+    if compare(results, baseline, options.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
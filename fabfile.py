@@ -17,6 +17,12 @@ def run_server(*args):
     local('./virtualenv/bin/twistd -n spacecraft %s' % ' '.join(args))
 
 
+def run_replay(path, *args):
+    check_bootstrap()
+    local('./virtualenv/bin/twistd -n spacecraft-replay %s %s' % (
+        ' '.join(args), path))
+
+
 def run_client():
     check_bootstrap()
     local('PYTHONPATH=. ./virtualenv/bin/python spacecraft/manual_client.py')
@@ -75,6 +81,24 @@ def cross(*bots):
     for proc in procs:
         proc.terminate()
 
+def headless(*bots):
+    """Play bots against each other without a server, as fast as possible"""
+    check_bootstrap()
+    local('PYTHONPATH=. ./virtualenv/bin/python -m spacecraft.headless %s'
+        % ' '.join(bots))
+
+def tournament(*bots):
+    """Rank bots playing every pair of them, on all the CPUs"""
+    check_bootstrap()
+    local('PYTHONPATH=. ./virtualenv/bin/python -m spacecraft.tournament %s'
+        % ' '.join(bots))
+
+def bench(*args):
+    """Run the benchmarks and compare them with the stored baseline"""
+    check_bootstrap()
+    local('PYTHONPATH=. ./virtualenv/bin/python -m benchmarks.bench %s'
+        % ' '.join(args))
+
 # -----------------------------------------------------------------
 # Tasks from here down aren't intended to be used directly
 
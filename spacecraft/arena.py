@@ -0,0 +1,109 @@
+# -*- coding: utf-8 *-*
+"""Many games in one server process.
+
+Each game is an arena with a name. Clients pick one by sending
+{"type": "join_arena", "value": name} as soon as they connect, see
+server.Client.waitForArena. Unknown names create a new arena while there
+is room for it, and arenas other than the default one go away once
+nobody is connected to them.
+"""
+import json
+from collections import OrderedDict
+
+from twisted.application import service
+from twisted.internet import reactor, task
+from twisted.web import resource
+
+
+class ArenaManager(service.Service):
+    """Owns the arenas and steps all of them off a single clock.
+
+    Every tick each arena takes one step. The steps run through a
+    Cooperator, so the reactor gets to handle network traffic between
+    them when a tick takes long, and the arena that goes first changes
+    every tick so none of them is always the one to wait.
+    """
+    default = "default"
+    # seconds to wait for a client to say which arena it wants
+    join_timeout = 0.5
+    clock = reactor
+
+    def __init__(self, make_game, max_arenas=1, frames=20, keep_default=True):
+        self.make_game = make_game
+        self.max_arenas = max_arenas
+        # without it the default arena is like any other
+        self.keep_default = keep_default
+        self.time_step = 1. / frames
+        self.arenas = OrderedDict()
+        self.turn = 0
+        self.cooperator = task.Cooperator(
+            scheduler=lambda work: self.clock.callLater(0, work))
+        self.loop = task.LoopingCall(self.tick)
+        if keep_default:
+            self.get_arena(self.default)
+
+    def startService(self):
+        service.Service.startService(self)
+        self.loop.clock = self.clock
+        self.loop.start(self.time_step)
+
+    def stopService(self):
+        service.Service.stopService(self)
+        if self.loop.running:
+            self.loop.stop()
+        for game in self.arenas.values():
+            game.close()
+
+    def get_arena(self, name=None):
+        """The game called name, created if needed.
+
+        Returns None if it doesn't exist and there are too many already.
+        """
+        if name is None:
+            name = self.default
+        game = self.arenas.get(name)
+        if game is None and len(self.arenas) < self.max_arenas:
+            game = self.arenas[name] = self.make_game()
+        return game
+
+    def prune(self):
+        """Drops the arenas nobody is connected to, except the default."""
+        for name, game in self.arenas.items():
+            if self.keep_default and name == self.default:
+                continue
+            if not len(game.clients):
+                del self.arenas[name]
+                game.close()
+
+    def tick(self):
+        self.prune()
+        games = self.arenas.values()
+        if not games:
+            return
+        first = self.turn % len(games)
+        self.turn += 1
+        return self.cooperator.coiterate(
+            self.step(games[first:] + games[:first]))
+
+    def step(self, games):
+        for game in games:
+            game.doStep()
+            yield None
+
+    def summary(self):
+        return [dict(name=name, status=game.status, step=game.step,
+                players=len(game.players), clients=len(game.clients))
+            for name, game in self.arenas.iteritems()]
+
+
+class ArenaResource(resource.Resource):
+    """Serves the list of arenas as json."""
+    isLeaf = True
+
+    def __init__(self, arenas):
+        resource.Resource.__init__(self)
+        self.arenas = arenas
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(self.arenas.summary())
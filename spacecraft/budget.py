@@ -0,0 +1,68 @@
+# -*- coding: utf-8 *-*
+"""Trade simulation fidelity for capacity when ticks run long.
+
+Enable it by setting Game.budget to a TickBudget. The server does that with
+--adaptive, and with --stats too the current level is in /stats.
+"""
+from twisted.python import log
+
+
+class TickBudget(object):
+    """Watches how long the ticks of a game take and sets how much it does.
+
+    When the average tick gets over high of the time step, the game moves
+    one level down: first fewer solver iterations, halving them down to
+    min_iters, then sending updates to clients every other tick, every
+    third, and so on up to max_send_every. When it gets under low it moves
+    back up, in the opposite order.
+    """
+    high = 0.8
+    low = 0.5
+    # how many ticks in a row it has to be over or under to change level
+    patience = 20
+    # weight of the last tick in the running average
+    smoothing = 0.1
+
+    def __init__(self, time_step, vel_iters=10, pos_iters=10, min_iters=2,
+            max_send_every=4):
+        self.time_step = time_step
+        # (vel_iters, pos_iters, send_every), from the best to the cheapest
+        self.levels = [(vel_iters, pos_iters, 1)]
+        while vel_iters > min_iters or pos_iters > min_iters:
+            vel_iters = min(vel_iters, max(min_iters, vel_iters // 2))
+            pos_iters = min(pos_iters, max(min_iters, pos_iters // 2))
+            self.levels.append((vel_iters, pos_iters, 1))
+        for send_every in range(2, max_send_every + 1):
+            self.levels.append((vel_iters, pos_iters, send_every))
+        self.level = 0
+        self.average = 0.0
+        self.over = self.under = 0
+
+    def apply(self, game):
+        game.vel_iters, game.pos_iters, game.send_every = \
+            self.levels[self.level]
+
+    def end_tick(self, game, seconds):
+        self.average += (seconds - self.average) * self.smoothing
+        load = self.average / self.time_step
+        self.over = self.over + 1 if load > self.high else 0
+        self.under = self.under + 1 if load < self.low else 0
+        if self.over >= self.patience and self.level < len(self.levels) - 1:
+            self.change(game, self.level + 1, load)
+        elif self.under >= self.patience and self.level > 0:
+            self.change(game, self.level - 1, load)
+
+    def change(self, game, level, load):
+        self.level = level
+        self.over = self.under = 0
+        self.apply(game)
+        game.record("iterations", vel_iters=game.vel_iters,
+            pos_iters=game.pos_iters)
+        log.msg("tick load %.0f%%, now at vel_iters=%s pos_iters=%s "
+            "send_every=%s" % ((load * 100,) + self.levels[level]))
+
+    def summary(self):
+        vel_iters, pos_iters, send_every = self.levels[self.level]
+        return dict(level=self.level, levels=len(self.levels),
+            load=self.average / self.time_step, vel_iters=vel_iters,
+            pos_iters=pos_iters, send_every=send_every)
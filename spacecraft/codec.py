@@ -0,0 +1,63 @@
+# -*- coding: utf-8 *-*
+"""Ways of putting messages on the wire.
+
+A codec turns a message dict into bytes and back, and knows how to frame
+those bytes so that the other end can split them apart again. Every
+connection starts speaking json, see ClientBase for how to switch.
+"""
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+class JSONCodec(object):
+    """One json encoded message per line."""
+    name = "json"
+    delimiter = "\r\n"
+
+    def encode(self, message):
+        return json.dumps(message)
+
+    def decode(self, data):
+        return json.loads(data)
+
+    def frame(self, data):
+        return data + self.delimiter
+
+
+class BinaryCodec(object):
+    """msgpack encoded messages, prefixed with their length.
+
+    Floats are packed in single precision, which is all the precision Box2D
+    keeps anyway. The length is a 4 byte big endian unsigned int, so the
+    first byte of a frame is always zero and can't be confused with the
+    start of a json line.
+    """
+    name = "binary"
+    header = struct.Struct("!I")
+    max_length = 0xffffff
+
+    def encode(self, message):
+        return msgpack.packb(message, use_single_float=True)
+
+    def decode(self, data):
+        try:
+            return msgpack.unpackb(data, raw=False)
+        except Exception, e:
+            raise ValueError(str(e))
+
+    def frame(self, data):
+        if len(data) > self.max_length:
+            raise ValueError("message too long: %i bytes" % len(data))
+        return self.header.pack(len(data)) + data
+
+
+JSON = JSONCodec()
+
+codecs = {JSON.name: JSON}
+if msgpack is not None:
+    codecs[BinaryCodec.name] = BinaryCodec()
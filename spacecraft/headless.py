@@ -0,0 +1,176 @@
+# -*- coding: utf-8 *-*
+"""Play games with in-process bots, as fast as the CPU allows.
+
+There is no reactor and no sockets involved: the game is stepped in a
+loop, updates are handed to the bots as dicts and their commands are fed
+straight back to the server side protocol. Useful to evaluate bots against
+each other, e.g.:
+
+    python -m spacecraft.headless bots/rand.py bots/tracker.py
+"""
+import imp
+import inspect
+import os
+import sys
+from optparse import OptionParser
+
+from twisted.internet import error
+from twisted.python import failure, log
+
+from spacecraft import server, world, map, inputlog
+
+
+class LoopbackTransport(object):
+    """Hands whatever is written to it to the protocol at the other end."""
+    disconnecting = False
+
+    def __init__(self, protocol, peer):
+        self.protocol = protocol
+        self.peer = peer
+
+    def write(self, data):
+        self.peer.dataReceived(data)
+
+    def writeSequence(self, data):
+        self.write(''.join(data))
+
+    def loseConnection(self):
+        if self.disconnecting:
+            return
+        self.disconnecting = self.peer.transport.disconnecting = True
+        reason = failure.Failure(error.ConnectionDone())
+        self.protocol.connectionLost(reason)
+        self.peer.connectionLost(reason)
+
+    abortConnection = loseConnection
+
+    def registerProducer(self, producer, streaming):
+        # everything is handed over right away, nothing to throttle
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+    def getPeer(self):
+        return "headless"
+
+    getHost = getPeer
+
+
+class HeadlessPlayer(server.Player):
+    """A player that registers right away and talks to a bot in memory."""
+    addr = "headless"
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    def register(self, map):
+        self.map = map
+        # the bot may answer anything we send, so have a ship ready first
+        self.object = world.PlayerObject(map)
+        map.register_client(self)
+        self.sendHello()
+
+    def sendMessage(self, *args, **kwargs):
+        if args and kwargs:
+            raise TypeError("cant use both args and kwargs.")
+        # skip encoding, the bot gets the dict itself
+        if self.transport.disconnecting:
+            return
+        try:
+            self.bot.dispatchMessage(args[0] if args else kwargs)
+        except Exception:
+            # just like a bot process dying, the rest of the game goes on
+            log.err(None, "bot %r crashed" % (self.object.name,))
+            self.transport.loseConnection()
+
+
+class Match(object):
+    """A game between bots, stepped without waiting for the clock."""
+
+    def __init__(self, bots, xsize=100, ysize=100, map_file=None, seed=None,
+            record=None):
+        self.game = world.Game(xsize, ysize, seed=seed)
+        if map_file:
+            map.MapLoader(map_file).setup_map(self.game)
+        # a file to write the inputs of the game to, see inputlog
+        if record is not None:
+            inputlog.InputLog(self.game, record, map_file)
+        self.players = [self.add_bot(bot) for bot in bots]
+
+    def add_bot(self, bot):
+        player = HeadlessPlayer(bot)
+        player.makeConnection(LoopbackTransport(player, bot))
+        bot.makeConnection(LoopbackTransport(bot, player))
+        player.register(self.game)
+        return player
+
+    def run(self, max_steps=None):
+        """Plays until somebody wins or max_steps, and returns the results.
+
+        See Game.get_results.
+        """
+        self.game.start_game()
+        while self.game.status != world.STATUS_FINISHED:
+            if max_steps is not None and self.game.step >= max_steps:
+                break
+            self.game.doStep()
+        self.game.close()
+        return self.game.get_results()
+
+
+def load_bot(spec):
+    """Returns the bot class in a file, "path/to/bot.py[:ClassName]".
+
+    Without a class name the file must define exactly one client class
+    that no other class there inherits from.
+    """
+    path, _, class_name = spec.partition(':')
+    directory, filename = os.path.split(os.path.abspath(path))
+    # bots import their neighbours
+    if directory not in sys.path:
+        sys.path.append(directory)
+    module = imp.load_source(os.path.splitext(filename)[0], path)
+    if class_name:
+        return getattr(module, class_name)
+    classes = [value for value in vars(module).values()
+        if inspect.isclass(value) and issubclass(value, server.ClientBase)
+        and value.__module__ == module.__name__]
+    leaves = [cls for cls in classes
+        if not any(other is not cls and issubclass(other, cls)
+            for other in classes)]
+    if len(leaves) != 1:
+        raise ValueError("Can't tell which bot to use from %s, use %s:Class"
+            % (path, path))
+    return leaves[0]
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] bot.py[:Class] ...")
+    parser.add_option("-x", "--xsize", type="int", default=100,
+                      help="The map x size.")
+    parser.add_option("-y", "--ysize", type="int", default=100,
+                      help="The map y size.")
+    parser.add_option("-m", "--map", default=None,
+                      help="Play on this map.")
+    parser.add_option("-s", "--steps", type="int", default=10000,
+                      help="Stop the game after this many steps.")
+    parser.add_option("--seed", type="int", default=None,
+                      help="Seed the game's random numbers with this.")
+    parser.add_option("-r", "--record", default=None,
+                      help="Write an input log of the game to this file, "
+                      "see spacecraft.inputlog.")
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error("need at least two bots")
+    bots = [load_bot(spec)() for spec in args]
+    record = open(options.record, 'w') if options.record else None
+    match = Match(bots, options.xsize, options.ysize, options.map,
+        options.seed, record)
+    for frags, hits, name in match.run(options.steps):
+        print '%s: %i frags, %i hits' % (name, frags, hits)
+    print 'steps:', match.game.step
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 *-*
+"""Record what comes into a game from outside, and play it again.
+
+A game started with the same seed that gets the same inputs on the same
+ticks plays out exactly the same, so the log of a match is all it takes
+to run it again offline, without bots or a network, e.g. to profile or
+debug it:
+
+    python -m spacecraft.inputlog match.log
+
+The log is a json object per line: a header with what the game was made
+with, and then an entry for every input (players joining, leaving or
+sending commands, the game starting, solver iterations changing) with the
+tick it came in. Every checksum_interval ticks there is a checksum of the
+bodies too, to tell where a replay stopped matching.
+"""
+import json
+import struct
+import zlib
+from optparse import OptionParser
+
+from spacecraft import world, map
+
+VERSION = 1
+
+
+def checksum(game):
+    """A crc32 of the position, angle and velocity of every body."""
+    values = []
+    for body in game.get_bodies():
+        values.extend(body.position)
+        values.append(body.angle)
+        values.extend(body.linearVelocity)
+    return zlib.crc32(struct.pack('<%dd' % len(values), *values)) & 0xffffffff
+
+
+class InputLog(object):
+    """Writes the inputs of game to out, see the module docstring."""
+    checksum_interval = 100
+
+    def __init__(self, game, out, map_file=None):
+        self.game = game
+        self.out = out
+        self.write(dict(type="header", version=VERSION, xsize=game.xsize,
+            ysize=game.ysize, frames=int(round(1. / game.timeStep)),
+            vel_iters=game.vel_iters, pos_iters=game.pos_iters,
+            seed=game.seed, status=game.status, map=map_file))
+        game.inputs = self
+
+    def write(self, entry):
+        self.out.write(json.dumps(entry) + '\n')
+
+    def add(self, kind, **fields):
+        fields['type'] = kind
+        fields['tick'] = self.game.ticks
+        self.write(fields)
+
+    def end_tick(self):
+        if self.game.ticks % self.checksum_interval == 0:
+            self.add("checksum", value=checksum(self.game))
+        self.out.flush()
+
+    def close(self):
+        # so the replay goes on to the last tick
+        self.add("end")
+        self.game.inputs = None
+        self.out.close()
+
+
+class ReplayError(Exception):
+    """The log doesn't match the game being played."""
+
+
+class Replay(object):
+    """Plays a game again from the lines of its input log."""
+
+    def __init__(self, lines):
+        entries = [json.loads(line) for line in lines if line.strip()]
+        header = entries.pop(0)
+        if header.get('type') != "header" or \
+                header.get('version') != VERSION:
+            raise ReplayError("not an input log: %r" % (header,))
+        self.header = header
+        self.entries = entries
+        self.game = world.Game(header['xsize'], header['ysize'],
+            frames=header['frames'],
+            start=header['status'] == world.STATUS_RUNNING,
+            vel_iters=header['vel_iters'], pos_iters=header['pos_iters'],
+            seed=header['seed'])
+        if header['map']:
+            map.MapLoader(header['map']).setup_map(self.game)
+        # id in the log -> PlayerObject
+        self.players = {}
+        self.checksums = 0
+
+    def run(self):
+        """Plays every tick in the log, returns the game.
+
+        Raises ReplayError at the first checksum that doesn't match.
+        """
+        game = self.game
+        for entry in self.entries:
+            while game.ticks < entry['tick']:
+                game.doStep()
+            getattr(self, 'do_' + entry['type'])(entry)
+        return game
+
+    def player(self, entry):
+        return self.players[entry['id']]
+
+    def do_join(self, entry):
+        player = world.PlayerObject(self.game)
+        if player.get_id() != entry['id']:
+            raise ReplayError("player %s joined as %s on tick %s" % (
+                entry['id'], player.get_id(), entry['tick']))
+        self.players[entry['id']] = player
+
+    def do_leave(self, entry):
+        self.player(entry).destroy()
+
+    def do_name(self, entry):
+        player = self.player(entry)
+        player.name = entry['value']
+        self.game.register_client_name(player, entry['value'])
+
+    def do_throttle(self, entry):
+        self.player(entry).throttle = entry['value']
+
+    def do_turn(self, entry):
+        self.player(entry).turn = entry['value']
+
+    def do_fire(self, entry):
+        self.player(entry).fire = 1
+
+    def do_start_game(self, entry):
+        self.game.start_game()
+
+    def do_iterations(self, entry):
+        self.game.vel_iters = entry['vel_iters']
+        self.game.pos_iters = entry['pos_iters']
+
+    def do_end(self, entry):
+        pass
+
+    def do_checksum(self, entry):
+        if checksum(self.game) != entry['value']:
+            raise ReplayError("the game went another way on tick %s"
+                % entry['tick'])
+        self.checksums += 1
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] match.log")
+    parser.add_option("-p", "--profile", default=None,
+                      help="Write cProfile stats of the replay to this file.")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.error("need an input log")
+    with open(args[0]) as lines:
+        replay = Replay(lines)
+    if options.profile:
+        import cProfile
+        cProfile.runctx('replay.run()', globals(), locals(), options.profile)
+    else:
+        replay.run()
+    game = replay.game
+    for frags, hits, name in game.get_results():
+        print '%s: %i frags, %i hits' % (name, frags, hits)
+    print 'steps:', game.step
+    print 'checksums matched:', replay.checksums
+
+
+if __name__ == "__main__":
+    main()
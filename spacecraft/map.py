@@ -1,12 +1,11 @@
 # -*- coding: utf-8 *-*
 from xml.etree.ElementTree import ElementTree
 
-import Box2D
-
 from spacecraft import world
 
 
 class Wall(world.ObjectBase):
+    category = world.CATEGORY_WALL
 
     def __init__(self, game, node, transform):
         self.node = node
@@ -23,9 +22,10 @@ class Wall(world.ObjectBase):
         self.height = float(self.node.attrib["height"])
         self.body = self.map.world.CreateStaticBody(
             position=(self.x + self.width / 2, self.y + self.height / 2),
-            shapes=Box2D.b2PolygonShape(box=(self.width / 2, self.height / 2)),
             userData=self,
             )
+        self.body.CreatePolygonFixture(box=(self.width / 2, self.height / 2),
+            categoryBits=self.category, maskBits=self.mask)
 
     def get_type(self):
         return "wall"
@@ -5,6 +5,7 @@ from twisted.internet import reactor
 import math
 import pygame
 import euclid
+from collections import OrderedDict
 from optparse import OptionParser
 
 import spacecraft
@@ -84,9 +85,14 @@ class MessageLine(Message):
 
 
 class Monitor(spacecraft.server.ClientBase):
+    # ask the server for keyframes and deltas instead of full updates
+    delta = False
+    # the last "replay" message, when watching a recording
+    replay = None
 
     def __init__(self):
         self.messages = []
+        self.bodies = OrderedDict()  # what we know of the world in delta mode
         self.font = pygame.font.Font(None, 18)
         self.avatars = {}
         # For now, just load our only avatar
@@ -106,11 +112,28 @@ class Monitor(spacecraft.server.ClientBase):
             self._sparks = SparkEngine(self.screen)
         return self._sparks
 
+    def connectionMade(self):
+        spacecraft.server.ClientBase.connectionMade(self)
+        if self.delta:
+            self.command("monitor_mode", value="delta")
+
     def messageReceived(self, message):
         kind = message.get("type", None)
         if kind == "time":
-            self.update(self.messages + [message])
+            bodies = [dict(record, type="monitor")
+                for record in self.bodies.values()]
+            self.update(self.messages + bodies + [message])
             self.messages = []
+        elif kind == "monitor_keyframe":
+            self.bodies = OrderedDict(
+                (record.pop('id'), record) for record in message['objects'])
+        elif kind == "monitor_delta":
+            for record in message['created']:
+                self.bodies[record.pop('id')] = record
+            for fields in message['changed']:
+                self.bodies[fields.pop('id')].update(fields)
+            for object_id in message['destroyed']:
+                self.bodies.pop(object_id, None)
         elif kind == "map_description":
             # need to be smarter here, this works with current hardcoding
             self.terrain = message.get('terrain', [])
@@ -118,6 +141,8 @@ class Monitor(spacecraft.server.ClientBase):
             ylim = message.get('ysize')  * UNIVERSE_SCALING_FACTOR
             self.world_size = xlim, ylim
             self.scene.scale(UNIVERSE_SCALING_FACTOR)
+        elif kind == "replay":
+            self.replay = message
         else:
             self.messages.append(message)
 
@@ -140,6 +165,21 @@ class Monitor(spacecraft.server.ClientBase):
                     self.zoom_in()
                 elif event.key == pygame.K_DOWN:
                     self.zoom_out()
+                elif self.replay is not None:
+                    self.replay_key(event.key)
+
+    def replay_key(self, key):
+        """Moving around a recording, see spacecraft.replay."""
+        if key == pygame.K_PAGEUP:
+            self.command("skip", value=10)
+        elif key == pygame.K_PAGEDOWN:
+            self.command("skip", value=-10)
+        elif key == pygame.K_HOME:
+            self.command("seek", value=self.replay['first_tick'])
+        elif key == pygame.K_PERIOD:
+            self.command("speed", value=(self.replay['speed'] or 1) * 2)
+        elif key == pygame.K_COMMA:
+            self.command("speed", value=(self.replay['speed'] or 1) / 2.)
 
     def zoom_in(self):
         self.scene.scale(1.1)
@@ -316,12 +356,21 @@ class Monitor(spacecraft.server.ClientBase):
 class MonitorFactory(ClientFactory):
     protocol = Monitor
 
-    def __init__(self, screen):
+    def __init__(self, screen, delta=False, codec="json", arena=None,
+            rate=None):
         self.screen = screen
+        self.delta = delta
+        self.codec = codec
+        self.arena = arena
+        self.rate = rate
 
     def buildProtocol(self, addr):
         proto = ClientFactory.buildProtocol(self, addr)
         proto.screen = self.screen
+        proto.delta = self.delta
+        proto.preferred_codec = self.codec
+        proto.arena = self.arena
+        proto.update_rate = self.rate
         proto.scene = Scene(self.screen)
         return proto
 
@@ -339,22 +388,35 @@ def parse_size(size):
     assert 0 < width, "Width must be > 0"
     return width, height
 
-def main(size):
+def main(size, delta=False, codec="json", arena=None, rate=None):
 
     pygame.init()
     pygame.font.init()
     pygame.display.set_caption('monitor')
     screen = pygame.display.set_mode(size)
 
-    reactor.connectTCP("localhost", 11105, MonitorFactory(screen))
+    reactor.connectTCP("localhost", 11105, MonitorFactory(screen, delta, codec,
+        arena, rate))
 
 
 if __name__ == "__main__":
     parser = OptionParser()
     parser.add_option("-s", "--size", dest="size", default="700x700",
                       help="Set viewport size", metavar="WIDTHxHEIGHT")
+    parser.add_option("-d", "--delta", dest="delta", action="store_true",
+                      default=False,
+                      help="Ask for keyframes and deltas instead of full updates")
+    parser.add_option("-c", "--codec", dest="codec", default="json",
+                      help="Wire format to ask the server for, json or binary")
+    parser.add_option("-a", "--arena", dest="arena", default=None,
+                      help="Watch the game with this name, on servers with "
+                      "many")
+    parser.add_option("-r", "--rate", dest="rate", type="float", default=None,
+                      help="Updates per second to ask for, one per game tick "
+                      "by default")
     (options, args) = parser.parse_args()
     size = parse_size(options.size)
-    reactor.callWhenRunning(main, size)
+    reactor.callWhenRunning(main, size, options.delta, options.codec,
+        options.arena, options.rate)
     reactor.run()
     pygame.quit()
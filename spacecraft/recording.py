@@ -0,0 +1,334 @@
+# -*- coding: utf-8 *-*
+"""Compact recordings of what happens in a game, tick by tick.
+
+Enable it by setting Game.recorder to a Recorder. The server does that
+for every game with --archive.
+
+A recording starts with a header: the map, and the bodies that never
+move (walls), once. Then come chunks of chunk_ticks ticks each, written
+as they fill up, so the recorder never holds more than one of them. A
+chunk is compressed on its own and has the state of every other body on
+each of its ticks, column by column: ids, types, positions, angles,
+velocities, throttle and health. So a chunk can be decoded without
+reading the ones before it, and its first tick is a keyframe. An index
+of where each chunk starts goes at the end when the recording is closed;
+recordings that were never closed are indexed by walking their chunks.
+
+    file   := magic version header_length header chunk* [index footer]
+    chunk  := "CHNK" first_tick ticks length zlib(payload)
+    payload := meta_length meta ticks[] steps[] counts[] ids[]
+               x[] y[] angle[] vx[] vy[] throttle[] health[] types[]
+    index  := "INDX" count (first_tick ticks offset)*
+    footer := index_offset "SEND"
+
+Numbers are little endian; meta and header are json. Floats are single
+precision, like the binary codec sends them. Throttle and health are NaN
+for objects that don't have them.
+"""
+import bisect
+import json
+import math
+import mmap
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy
+from Box2D import b2
+
+MAGIC = 'SPACEREC'
+VERSION = 1
+
+file_header = struct.Struct('<8sHI')
+chunk_header = struct.Struct('<4sIII')
+meta_header = struct.Struct('<I')
+index_header = struct.Struct('<4sI')
+index_entry = numpy.dtype([('first_tick', '<u4'), ('ticks', '<u4'),
+    ('offset', '<u8')])
+footer = struct.Struct('<Q4s')
+
+# the float columns, in the order they are written
+COLUMNS = ('x', 'y', 'angle', 'vx', 'vy', 'throttle', 'health')
+
+
+class Recorder(object):
+    """Writes what happens in game to out (a file open for writing)."""
+    chunk_ticks = 100
+    compression = 6
+
+    def __init__(self, game, out, chunk_ticks=None):
+        self.game = game
+        self.out = out
+        if chunk_ticks is not None:
+            self.chunk_ticks = chunk_ticks
+        snapshot = game.get_snapshot()
+        static = [dict(snapshot[body.userData.get_id()],
+                id=body.userData.get_id())
+            for body in game.get_bodies() if body.type == b2.staticBody]
+        self.static_ids = set(record['id'] for record in static)
+        header = json.dumps(dict(
+            xsize=game.xsize, ysize=game.ysize,
+            frames=int(round(1. / game.timeStep)), seed=game.seed,
+            chunk_ticks=self.chunk_ticks,
+            map=game.get_map_description(), static=static))
+        out.write(file_header.pack(MAGIC, VERSION, len(header)))
+        out.write(header)
+        # so readers know the game is being recorded before the first chunk
+        out.flush()
+        self.offset = file_header.size + len(header)
+        self.index = []
+        self.start_chunk()
+        game.recorder = self
+
+    def start_chunk(self):
+        self.ticks = []
+        self.steps = []
+        self.counts = []
+        self.ids = []
+        self.types = []
+        # COLUMNS values of each row, one after the other
+        self.values = []
+        # object type -> its number in this chunk
+        self.type_codes = {}
+        self.names = {}
+
+    def record_tick(self):
+        """Adds the current state of the game, call it once per tick."""
+        nan = float('nan')
+        type_codes = self.type_codes
+        ids = self.ids
+        types = self.types
+        values = self.values
+        count = 0
+        for object_id, record in self.game.get_snapshot().iteritems():
+            if object_id in self.static_ids:
+                continue
+            object_type = record['object_type']
+            code = type_codes.get(object_type)
+            if code is None:
+                code = type_codes[object_type] = len(type_codes)
+            x, y = record['position']
+            vx, vy = record['velocity']
+            ids.append(object_id)
+            types.append(code)
+            values.extend((x, y, record['angle'], vx, vy,
+                record.get('throttle', nan), record.get('health', nan)))
+            name = record.get('name')
+            if name is not None:
+                self.names[object_id] = name
+            count += 1
+        self.ticks.append(self.game.ticks)
+        self.steps.append(self.game.step)
+        self.counts.append(count)
+        if len(self.ticks) >= self.chunk_ticks:
+            self.write_chunk()
+
+    def write_chunk(self):
+        if not self.ticks:
+            return
+        types = sorted(self.type_codes, key=self.type_codes.get)
+        meta = json.dumps(dict(types=types, names=self.names))
+        values = numpy.array(self.values, dtype='<f4').reshape(
+            -1, len(COLUMNS))
+        payload = ''.join([
+            meta_header.pack(len(meta)), meta,
+            numpy.array(self.ticks, dtype='<u4').tobytes(),
+            numpy.array(self.steps, dtype='<u4').tobytes(),
+            numpy.array(self.counts, dtype='<u4').tobytes(),
+            numpy.array(self.ids, dtype='<u4').tobytes(),
+            values.T.tobytes(),
+            numpy.array(self.types, dtype='u1').tobytes()])
+        data = zlib.compress(payload, self.compression)
+        self.out.write(chunk_header.pack('CHNK', self.ticks[0],
+            len(self.ticks), len(data)))
+        self.out.write(data)
+        self.out.flush()
+        self.index.append((self.ticks[0], len(self.ticks), self.offset))
+        self.offset += chunk_header.size + len(data)
+        self.start_chunk()
+
+    def close(self):
+        """Writes what's left and the index."""
+        self.write_chunk()
+        index = numpy.array(self.index, dtype=index_entry)
+        self.out.write(index_header.pack('INDX', len(index)))
+        self.out.write(index.tobytes())
+        self.out.write(footer.pack(self.offset, 'SEND'))
+        self.out.close()
+        self.game.recorder = None
+
+
+class RecordingError(Exception):
+    """Not a recording, or a broken one."""
+
+
+class Chunk(object):
+    """The decoded ticks of a chunk."""
+
+    def __init__(self, payload, ticks):
+        meta_length, = meta_header.unpack_from(payload)
+        offset = meta_header.size
+        meta = json.loads(payload[offset:offset + meta_length])
+        offset += meta_length
+        self.types = meta['types']
+        self.names = dict((int(object_id), name)
+            for object_id, name in meta['names'].iteritems())
+        arrays = []
+
+        def read(dtype, count):
+            array = numpy.frombuffer(payload, dtype, count,
+                offset + sum(a.nbytes for a in arrays))
+            arrays.append(array)
+            return array
+        self.ticks = read('<u4', ticks)
+        self.steps = read('<u4', ticks)
+        self.counts = read('<u4', ticks)
+        rows = int(self.counts.sum())
+        self.ids = read('<u4', rows)
+        self.values = read('<f4', rows * len(COLUMNS)).reshape(
+            len(COLUMNS), rows)
+        self.type_codes = read('u1', rows)
+        # where the rows of each tick start
+        self.starts = numpy.zeros(ticks + 1, dtype=int)
+        numpy.cumsum(self.counts, out=self.starts[1:])
+
+    def records(self, i):
+        """(step, [(id, record), ...]) of the i-th tick of the chunk."""
+        start, end = self.starts[i], self.starts[i + 1]
+        x, y, angle, vx, vy, throttle, health = \
+            self.values[:, start:end].tolist()
+        types = [self.types[code]
+            for code in self.type_codes[start:end].tolist()]
+        names = self.names
+        result = []
+        for row, object_id in enumerate(self.ids[start:end].tolist()):
+            record = dict(object_type=types[row], position=(x[row], y[row]),
+                angle=angle[row], velocity=(vx[row], vy[row]))
+            if not math.isnan(throttle[row]):
+                record['throttle'] = throttle[row]
+            if not math.isnan(health[row]):
+                record['health'] = health[row]
+            if object_id in names:
+                record['name'] = names[object_id]
+            result.append((object_id, record))
+        return int(self.steps[i]), result
+
+
+class Recording(object):
+    """Reads a recording, mapped in memory rather than loaded.
+
+    Only the chunks asked for are decompressed, and the pages of the file
+    are shared by everybody reading it. The last cache_chunks chunks
+    decoded are kept, so readers going through the same part of the
+    recording decode it once.
+    """
+    cache_chunks = 4
+
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        try:
+            self.data = mmap.mmap(self.file.fileno(), 0,
+                access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError):
+            self.file.close()
+            raise RecordingError("empty or unreadable recording %s" % path)
+        data = self.data
+        if len(data) < file_header.size:
+            raise RecordingError("not a recording: %s" % path)
+        magic, version, length = file_header.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise RecordingError("not a recording: %s" % path)
+        start = file_header.size
+        if len(data) < start + length:
+            raise RecordingError("header of %s not written yet" % path)
+        self.header = json.loads(data[start:start + length])
+        self.static = [(record.pop('id'), record)
+            for record in self.header['static']]
+        self.chunks_start = start + length
+        self.index = self.read_index()
+        self.first_ticks = [first for first, ticks, offset in self.index]
+        # chunk number -> Chunk, least recently used first
+        self.chunks = OrderedDict()
+
+    def read_index(self):
+        data = self.data
+        if len(data) >= self.chunks_start + footer.size:
+            offset, magic = footer.unpack_from(data, len(data) - footer.size)
+            if magic == 'SEND':
+                tag, count = index_header.unpack_from(data, offset)
+                index = numpy.frombuffer(data, index_entry, count,
+                    offset + index_header.size)
+                return [(int(first), int(ticks), int(offset))
+                    for first, ticks, offset in index]
+        return self.scan()
+
+    def scan(self):
+        """Indexes the chunks of a recording that wasn't closed."""
+        index = []
+        offset = self.chunks_start
+        end = len(self.data)
+        while offset + chunk_header.size <= end:
+            tag, first, ticks, length = chunk_header.unpack_from(
+                self.data, offset)
+            if tag != 'CHNK' or \
+                    offset + chunk_header.size + length > end:
+                break
+            index.append((first, ticks, offset))
+            offset += chunk_header.size + length
+        return index
+
+    @property
+    def first_tick(self):
+        return self.index[0][0] if self.index else None
+
+    @property
+    def last_tick(self):
+        if not self.index:
+            return None
+        first, ticks, offset = self.index[-1]
+        return first + ticks - 1
+
+    def chunk(self, i):
+        """The i-th chunk, decoded."""
+        chunk = self.chunks.pop(i, None)
+        if chunk is None:
+            chunk = self.decode(i)
+            if len(self.chunks) >= self.cache_chunks:
+                self.chunks.popitem(last=False)
+        self.chunks[i] = chunk
+        return chunk
+
+    def decode(self, i):
+        first, ticks, offset = self.index[i]
+        tag, first, ticks, length = chunk_header.unpack_from(self.data,
+            offset)
+        start = offset + chunk_header.size
+        try:
+            payload = zlib.decompress(self.data[start:start + length])
+        except zlib.error, e:
+            raise RecordingError("broken chunk at %d: %s" % (offset, e))
+        return Chunk(payload, ticks)
+
+    def find(self, tick):
+        """The number of the chunk with tick, and where in it it is."""
+        i = bisect.bisect_right(self.first_ticks, tick) - 1
+        if i < 0:
+            raise IndexError("tick %d is before the recording" % tick)
+        first, ticks, offset = self.index[i]
+        if tick >= first + ticks:
+            raise IndexError("tick %d is after the recording" % tick)
+        return i, tick - first
+
+    def records(self, tick):
+        """(step, {id: record}) for tick, walls included.
+
+        Records are like those of Game.get_snapshot.
+        """
+        i, position = self.find(tick)
+        step, records = self.chunk(i).records(position)
+        return step, OrderedDict(self.static + records)
+
+    def close(self):
+        self.chunks.clear()
+        self.data.close()
+        self.file.close()
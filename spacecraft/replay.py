@@ -0,0 +1,323 @@
+# -*- coding: utf-8 *-*
+"""Serves recordings (see spacecraft.recording) to monitors.
+
+Monitors connect to it like they do to a game server and get the same
+frames, full or delta, at the rate they ask for. Each of them watches
+its own playback and can move it around with:
+
+    {"type": "start_game"}               pause or play
+    {"type": "seek", "value": tick}      go to a tick of the recording
+    {"type": "skip", "value": seconds}   go forward or back in time
+    {"type": "speed", "value": factor}   0 pauses, negative plays backwards
+
+and gets {"type": "replay", "tick": ..., "first_tick": ..., "last_tick":
+..., "speed": ..., "frames": ...} when it joins and after each of those.
+
+Given a directory, monitors pick a recording by name (its file name
+without .rec) like they pick an arena, the newest one by default. Every
+recording is opened, and mapped in memory, once: whoever watches it shares
+its pages and the chunks decoded last, so many monitors on the same
+recording cost little more than one. Recordings still being written are
+opened again when their file changes, so playing one to its end follows
+the game as it goes.
+"""
+import math
+import os
+from collections import OrderedDict
+
+from twisted.application import internet, service
+from twisted.internet import reactor, task
+from twisted.internet.protocol import Factory
+from twisted.python import log, usage
+
+from spacecraft import recording, server, world
+
+
+class Playback(object):
+    """Plays a recording.Recording to monitors like a world.Game would."""
+    keep_snapshots = 20
+    clock = reactor
+    # see server.Client.wantsUpdate
+    send_every = 1
+
+    def __init__(self, recording, reopen=None):
+        self.recording = recording
+        # returns the recording as it is now, for those still being written
+        self.reopen = reopen
+        header = recording.header
+        self.xsize = header['xsize']
+        self.ysize = header['ysize']
+        self.frames = header['frames']
+        self.timeStep = 1. / self.frames
+        self.clients = world.Registry()
+        # number of times doStep was called, what snapshots are kept by
+        self.ticks = 0
+        self.step = 0
+        self.snapshots = {}
+        self.tick_cache = {}
+        # the tick of the recording being played, and how far into the
+        # next one we are at speeds that aren't whole
+        self.tick = recording.first_tick
+        self.fraction = 0.
+        self.speed = 1.
+        # what start_game goes back to after a pause
+        self.paused_speed = None
+        self.loop = task.LoopingCall(self.doStep)
+
+    def register_client(self, client):
+        self.clients.add(client)
+        if not self.loop.running:
+            self.loop.clock = self.clock
+            self.loop.start(self.timeStep, now=False)
+
+    def unregister_client(self, client):
+        self.clients.discard(client)
+        if not len(self.clients) and self.loop.running:
+            self.loop.stop()
+
+    def notifyEvent(self, **kwargs):
+        for client in self.clients:
+            client.sendMessage(**kwargs)
+
+    def cached(self, key, build):
+        try:
+            return self.tick_cache[key]
+        except KeyError:
+            value = self.tick_cache[key] = build()
+            return value
+
+    def get_map_description(self):
+        return self.recording.header['map']
+
+    def get_snapshot(self):
+        """The records of the tick being played, like Game.get_snapshot."""
+        return self.cached('snapshot', self._read_snapshot)
+
+    def _read_snapshot(self):
+        self.step, snapshot = self.recording.records(self.tick)
+        self.snapshots[self.ticks] = snapshot
+        for ticks in self.snapshots.keys():
+            if ticks <= self.ticks - self.keep_snapshots:
+                del self.snapshots[ticks]
+        return snapshot
+
+    def describe(self):
+        return dict(type="replay", tick=self.tick,
+            first_tick=self.recording.first_tick,
+            last_tick=self.recording.last_tick, speed=self.speed,
+            frames=self.frames)
+
+    def doStep(self):
+        self.ticks += 1
+        self.tick_cache = {}
+        self.fraction += self.speed
+        whole = int(math.floor(self.fraction))
+        self.fraction -= whole
+        self.move(self.tick + whole)
+        for client in self.clients:
+            client.hold()
+        for client in self.clients:
+            if client.wantsUpdate():
+                client.sendUpdate()
+        for client in self.clients:
+            client.flush()
+
+    def move(self, tick):
+        if tick > self.recording.last_tick and self.reopen is not None:
+            # maybe more has been written since
+            self.recording = self.reopen()
+        self.tick = max(self.recording.first_tick,
+            min(self.recording.last_tick, tick))
+
+    def seek(self, tick):
+        """Jumps to tick, or as close as the recording goes."""
+        self.move(tick)
+        self.fraction = 0.
+        # nothing to diff against, monitors get a keyframe next
+        self.snapshots = {}
+        self.tick_cache = {}
+        self.notifyEvent(**self.describe())
+
+    def set_speed(self, speed):
+        self.speed = speed
+        self.paused_speed = None
+        self.notifyEvent(**self.describe())
+
+    def start_game(self):
+        if self.speed:
+            self.paused_speed = self.speed
+            self.speed = 0.
+        else:
+            self.speed = self.paused_speed or 1.
+            self.paused_speed = None
+        self.notifyEvent(**self.describe())
+
+
+class Library(service.Service):
+    """The recordings to play, by name: a file, or a directory of them.
+
+    Works as the arenas of server.Client.waitForArena, every monitor gets
+    a Playback of its own on the recording it asks for.
+    """
+    join_timeout = 0.5
+    clock = reactor
+    default = None
+
+    def __init__(self, path):
+        self.path = path
+        self.single = not os.path.isdir(path)
+        # name -> ((size, mtime), recording.Recording), opened as they are
+        # asked for
+        self.recordings = {}
+        self.paths = OrderedDict()
+        if self.single:
+            self.default = self.name(path)
+            self.paths[self.default] = path
+            # fail now rather than when somebody connects
+            if not self.open(self.default).index:
+                raise recording.RecordingError(
+                    "nothing recorded in %s" % path)
+        else:
+            self.scan()
+
+    def name(self, path):
+        return os.path.splitext(os.path.basename(path))[0]
+
+    def scan(self):
+        """Finds the recordings in the directory, the newest last.
+
+        The default is the newest one with something to play: a game that
+        just started being recorded has no chunk yet.
+        """
+        paths = [os.path.join(self.path, name)
+            for name in os.listdir(self.path) if name.endswith('.rec')]
+        paths.sort(key=os.path.getmtime)
+        self.paths = OrderedDict((self.name(path), path) for path in paths)
+        self.default = next((name for name in reversed(self.paths)
+            if self.playable(name) is not None), None)
+
+    def open(self, name):
+        """The recording called name, opened again if its file changed.
+
+        Those still being written grow, and a mapping only has what was
+        there when it was made. Playbacks of the old one keep it until
+        they let it go.
+        """
+        path = self.paths[name]
+        stat = os.stat(path)
+        version = (stat.st_size, stat.st_mtime)
+        cached = self.recordings.get(name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        reader = recording.Recording(path)
+        self.recordings[name] = (version, reader)
+        return reader
+
+    def playable(self, name):
+        """The recording called name, or None if it has nothing to play."""
+        try:
+            reader = self.open(name)
+        except recording.RecordingError, e:
+            log.msg("Can't play %s: %s" % (name, e))
+            return None
+        if not reader.index:
+            return None
+        return reader
+
+    def get_arena(self, name=None):
+        """A new Playback of the recording called name.
+
+        Returns None if there is no such recording, or it's empty.
+        """
+        if not self.single:
+            self.scan()
+        if name is None:
+            name = self.default
+        if name not in self.paths:
+            return None
+        reader = self.playable(name)
+        if reader is None:
+            return None
+        playback = Playback(reader, lambda: self.open(name))
+        playback.clock = self.clock
+        return playback
+
+    def stopService(self):
+        service.Service.stopService(self)
+        for version, reader in self.recordings.values():
+            reader.close()
+        self.recordings.clear()
+
+
+class ReplayMonitor(server.Monitor):
+
+    def sendHello(self):
+        server.Monitor.sendHello(self)
+        if self.transport:
+            self.sendMessage(**self.map.describe())
+
+    def number(self, message):
+        value = message.get("value")
+        if not isinstance(value, (int, float)) or isinstance(value, bool):
+            log.msg("Bad %s message: %r" % (message.get("type"), message))
+            return None
+        return value
+
+    def do_seek(self, message):
+        tick = self.number(message)
+        if tick is not None:
+            self.map.seek(int(tick))
+
+    def do_skip(self, message):
+        seconds = self.number(message)
+        if seconds is not None:
+            ticks = int(round(seconds * self.map.frames))
+            self.map.seek(self.map.tick + ticks)
+
+    def do_speed(self, message):
+        speed = self.number(message)
+        if speed is not None:
+            self.map.set_speed(speed)
+
+
+class ReplayFactory(Factory):
+    protocol = ReplayMonitor
+
+    def __init__(self, library):
+        self.library = library
+
+    def buildProtocol(self, addr):
+        log.msg("Monitor connected from:", (addr,))
+        protocol = Factory.buildProtocol(self, addr)
+        # with a single recording there is nothing to choose
+        if self.library.single:
+            protocol.register(self.library.get_arena())
+        else:
+            protocol.waitForArena(self.library)
+        protocol.addr = addr
+        return protocol
+
+
+class Options(usage.Options):
+    synopsis = "[options] recording-or-directory"
+    optParameters = [
+        ["monitorport", "m", 11105,
+            "The port number to listen on for monitors.", int],
+        ]
+
+    def parseArgs(self, path):
+        self["recordings"] = path
+
+
+def makeService(options):
+    root_service = service.MultiService()
+
+    library = Library(options["recordings"])
+    library.setServiceParent(root_service)
+
+    monitor_service = internet.TCPServer(
+        options['monitorport'], ReplayFactory(library))
+    monitor_service.setName("monitors")
+    monitor_service.setServiceParent(root_service)
+
+    return root_service
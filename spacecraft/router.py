@@ -0,0 +1,441 @@
+# -*- coding: utf-8 *-*
+"""Spread the arenas of a server over many processes.
+
+The router owns the monitor and player ports. When a client connects it
+waits for join_arena (see server.Client.waitForArena), picks the worker
+process running that arena, or the least loaded one with room for it,
+and passes the socket to that worker over a unix socket together with
+whatever the client sent so far. From then on the client talks to the
+worker directly.
+
+Workers are started by the router, running this module:
+
+    python -m spacecraft.router /path/to/router.sock [server options]
+"""
+import base64
+import itertools
+import json
+import os
+import shutil
+import signal
+import socket
+import sys
+import tempfile
+
+from zope.interface import implements
+
+from twisted.application import internet, service
+from twisted.internet import interfaces, protocol, reactor, task
+from twisted.internet.endpoints import UNIXClientEndpoint
+from twisted.protocols.basic import LineReceiver
+from twisted.python import log
+from twisted.web import resource, static
+from twisted.web import server as web
+
+from spacecraft import arena, server, stats
+
+
+class Doorman(protocol.Protocol):
+    """Keeps a new client waiting until it's known where it goes."""
+    _buffer = ''
+
+    def connectionMade(self):
+        router = self.factory.router
+        self.timeout = router.clock.callLater(router.join_timeout,
+            self.handOff, None)
+
+    def dataReceived(self, data):
+        self._buffer += data
+        line, delimiter, rest = self._buffer.partition('\r\n')
+        if not delimiter:
+            if len(self._buffer) > LineReceiver.MAX_LENGTH:
+                self.handOff(None)
+            return
+        try:
+            message = json.loads(line)
+        except ValueError:
+            message = None
+        if isinstance(message, dict) and message.get('type') == 'join_arena':
+            self._buffer = rest
+            self.handOff(message.get('value'))
+        else:
+            self.handOff(None)
+
+    def handOff(self, name):
+        if self.timeout.active():
+            self.timeout.cancel()
+        self.transport.stopReading()
+        name = name or arena.ArenaManager.default
+        link = self.factory.router.place(name)
+        if link is None:
+            self.transport.write(json.dumps(dict(type="error",
+                value="no room for arena %r" % name)) + '\r\n')
+            self.transport.loseConnection()
+            return
+        fd = self.transport.fileno()
+        link.handOff(os.dup(fd), self.factory.kind, name, self._buffer)
+        # The worker has the connection now, so close our end of it. The
+        # transport shuts the socket down before closing it, and that acts
+        # on the socket every copy of the descriptor shares, cutting the
+        # worker off too. So put a socket nobody uses under our descriptor
+        # first, and let the transport shut that one down.
+        unused = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        os.dup2(unused.fileno(), fd)
+        unused.close()
+        self.transport.loseConnection()
+
+    def connectionLost(self, reason):
+        if self.timeout.active():
+            self.timeout.cancel()
+
+
+class DoormanFactory(protocol.Factory):
+    protocol = Doorman
+
+    def __init__(self, router, kind):
+        self.router = router
+        # "player" or "monitor", what the worker should treat it as
+        self.kind = kind
+
+
+class WorkerConnection(LineReceiver):
+    """The router's end of the link with a worker."""
+    pid = None
+    max_arenas = 0
+
+    def connectionMade(self):
+        self.ids = itertools.count()
+        # id -> (file descriptor, arena), until the worker has it
+        self.pending = {}
+        # the arenas running there, or about to
+        self.names = set()
+        self.arenas = []
+        # arena name -> stats.game_summary, with --stats
+        self.stats = {}
+
+    def lineReceived(self, line):
+        message = json.loads(line)
+        kind = message['type']
+        if kind == 'worker':
+            self.pid = message['pid']
+            self.max_arenas = message['max_arenas']
+            self.factory.router.addWorker(self)
+        elif kind == 'adopted':
+            fd, name = self.pending.pop(message['id'])
+            os.close(fd)
+        elif kind == 'load':
+            self.arenas = message['arenas']
+            self.stats = message.get('stats', {})
+            self.names = set(summary['name'] for summary in self.arenas)
+            self.names.update(name for fd, name in self.pending.values())
+            self.factory.router.forget(self)
+
+    def handOff(self, fd, kind, name, data):
+        connection_id = next(self.ids)
+        self.pending[connection_id] = (fd, name)
+        self.names.add(name)
+        self.transport.sendFileDescriptor(fd)
+        self.sendLine(json.dumps(dict(type="connection", id=connection_id,
+            kind=kind, arena=name, data=base64.b64encode(data))))
+
+    def hasRoom(self):
+        return len(self.names) < self.max_arenas
+
+    def load(self):
+        """How many clients it has, counting those on their way."""
+        return sum(summary['clients'] for summary in self.arenas) + \
+            len(self.pending)
+
+    def connectionLost(self, reason):
+        for fd, name in self.pending.values():
+            os.close(fd)
+        self.pending = {}
+        self.factory.router.removeWorker(self)
+
+    def summary(self):
+        return dict(pid=self.pid, arenas=self.arenas, load=self.load())
+
+
+class WorkerConnectionFactory(protocol.Factory):
+    protocol = WorkerConnection
+
+    def __init__(self, router):
+        self.router = router
+
+
+class WorkerProcess(protocol.ProcessProtocol):
+
+    def __init__(self, router):
+        self.router = router
+
+    def processEnded(self, reason):
+        log.msg("worker ended:", reason.value)
+        self.router.processes.remove(self)
+        if self.router.running:
+            self.router.spawn()
+
+
+class Router(service.Service):
+    """Starts the workers and decides which one gets each arena."""
+    join_timeout = arena.ArenaManager.join_timeout
+    clock = reactor
+
+    def __init__(self, options, socket_path):
+        self.options = options
+        self.socket_path = socket_path
+        self.workers = []
+        self.processes = []
+        # arena name -> the WorkerConnection of the worker running it
+        self.placements = {}
+
+    def startService(self):
+        service.Service.startService(self)
+        for i in range(self.options["workers"]):
+            self.spawn()
+
+    def spawn(self):
+        process = WorkerProcess(self)
+        args = [sys.executable, '-m', 'spacecraft.router', self.socket_path]
+        args.extend(worker_args(self.options))
+        reactor.spawnProcess(process, sys.executable, args, env=os.environ,
+            childFDs={0: 'w', 1: 1, 2: 2})
+        self.processes.append(process)
+
+    def addWorker(self, worker):
+        log.msg("worker joined:", worker.pid)
+        self.workers.append(worker)
+
+    def removeWorker(self, worker):
+        if worker in self.workers:
+            self.workers.remove(worker)
+        for name, placed in self.placements.items():
+            if placed is worker:
+                del self.placements[name]
+
+    def forget(self, worker):
+        """Drops the arenas a worker isn't running anymore."""
+        for name, placed in self.placements.items():
+            if placed is worker and name not in worker.names:
+                del self.placements[name]
+
+    def place(self, name):
+        """The worker for the arena called name, or None if all are full."""
+        worker = self.placements.get(name)
+        if worker is None:
+            candidates = [w for w in self.workers if w.hasRoom()]
+            if not candidates:
+                return None
+            worker = self.placements[name] = min(candidates,
+                key=lambda w: w.load())
+        return worker
+
+    def summary(self):
+        return [worker.summary() for worker in self.workers]
+
+    def stats(self, name):
+        """The last stats.game_summary of an arena its worker sent, or None."""
+        worker = self.placements.get(name)
+        if worker is None:
+            return None
+        return worker.stats.get(name)
+
+
+class RouterResource(resource.Resource):
+    """Serves the workers and their arenas as json."""
+    isLeaf = True
+
+    def __init__(self, router):
+        resource.Resource.__init__(self)
+        self.router = router
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(self.router.summary())
+
+
+class RouterStatsResource(resource.Resource):
+    """Serves the tick stats the workers report, see stats.py.
+
+    /stats/<arena> has those of an arena, /stats those of the default one.
+    """
+    isLeaf = True
+
+    def __init__(self, router):
+        resource.Resource.__init__(self)
+        self.router = router
+
+    def render_GET(self, request):
+        name = request.postpath[0] if request.postpath else ''
+        summary = self.router.stats(name or arena.ArenaManager.default)
+        if summary is None:
+            return resource.NoResource("No such arena.").render(request)
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(summary)
+
+
+def worker_args(options):
+    """The command line options a worker needs to make the games."""
+    args = ['--xsize', str(options['xsize']),
+        '--ysize', str(options['ysize']),
+        '--arenas', str(options['arenas']),
+        '--frames', str(options['frames']),
+        '--veliters', str(options['veliters']),
+        '--positers', str(options['positers'])]
+    if options['start']:
+        args.extend(['--start', '1'])
+    if options['map']:
+        args.extend(['--map', options['map']])
+    if options['stats']:
+        args.append('--stats')
+    if options['adaptive']:
+        args.append('--adaptive')
+    if options['seed'] is not None:
+        args.extend(['--seed', str(options['seed'])])
+    if options['record']:
+        args.extend(['--record', os.path.abspath(options['record'])])
+    if options['archive']:
+        args.extend(['--archive', os.path.abspath(options['archive'])])
+    return args
+
+
+def makeService(options):
+    root_service = service.MultiService()
+
+    directory = tempfile.mkdtemp(prefix='spacecraft-')
+    router = Router(options, os.path.join(directory, 'router.sock'))
+    cleanup = service.Service()
+    cleanup.stopService = lambda: shutil.rmtree(directory, True)
+    cleanup.setServiceParent(root_service)
+
+    link_service = internet.UNIXServer(router.socket_path,
+        WorkerConnectionFactory(router))
+    link_service.setServiceParent(root_service)
+    # workers connect once it's listening
+    router.setServiceParent(root_service)
+
+    monitor_service = internet.TCPServer(
+        options['monitorport'], DoormanFactory(router, "monitor"))
+    monitor_service.setName("monitors")
+    monitor_service.setServiceParent(root_service)
+
+    player_service = internet.TCPServer(
+        options['playerport'], DoormanFactory(router, "player"))
+    player_service.setName("players")
+    player_service.setServiceParent(root_service)
+
+    root_resource = static.File("static/")
+    root_resource.putChild("arenas", RouterResource(router))
+    if options["stats"]:
+        root_resource.putChild("stats", RouterStatsResource(router))
+    site = web.Site(root_resource)
+    web_service = internet.TCPServer(options['httpport'], site)
+    web_service.setServiceParent(root_service)
+
+    return root_service
+
+
+class HandOffFactory(protocol.Factory):
+    """Builds one protocol with factory and remembers it."""
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.built = None
+
+    def buildProtocol(self, addr):
+        self.built = self.factory.buildProtocol(addr)
+        return self.built
+
+
+class WorkerLink(LineReceiver):
+    """The worker's end of the link with the router."""
+    implements(interfaces.IFileDescriptorReceiver)
+    # seconds between load reports
+    report_interval = 1
+
+    def __init__(self, arenas, factories):
+        self.arenas = arenas
+        # connection kind -> the server factory for it
+        self.factories = factories
+        self.descriptors = []
+        self.report = task.LoopingCall(self.sendLoad)
+
+    def connectionMade(self):
+        self.sendMessage(type="worker", pid=os.getpid(),
+            max_arenas=self.arenas.max_arenas)
+        self.report.start(self.report_interval)
+
+    def sendMessage(self, **message):
+        self.sendLine(json.dumps(message))
+
+    def sendLoad(self):
+        # the router serves the stats, workers have no http port
+        arena_stats = dict((name, stats.game_summary(game))
+            for name, game in self.arenas.arenas.iteritems()
+            if game.stats is not None)
+        self.sendMessage(type="load", arenas=self.arenas.summary(),
+            stats=arena_stats)
+
+    def fileDescriptorReceived(self, descriptor):
+        # they come no later than the line they go with
+        self.descriptors.append(descriptor)
+
+    def lineReceived(self, line):
+        message = json.loads(line)
+        if message['type'] == 'connection':
+            self.adopt(self.descriptors.pop(0), message)
+
+    def adopt(self, descriptor, message):
+        factory = HandOffFactory(self.factories[message['kind']])
+        try:
+            reactor.adoptStreamConnection(descriptor, socket.AF_INET,
+                factory)
+        finally:
+            os.close(descriptor)
+            self.sendMessage(type="adopted", id=message['id'])
+        client = factory.built
+        client.joinArena(message['arena'])
+        data = base64.b64decode(message['data'])
+        if data:
+            client.dataReceived(data)
+
+    def connectionLost(self, reason):
+        if self.report.running:
+            self.report.stop()
+        # the router is gone, and workers go with it
+        reactor.stop()
+
+
+class WorkerLinkFactory(protocol.Factory):
+
+    def __init__(self, arenas, factories):
+        self.arenas = arenas
+        self.factories = factories
+
+    def buildProtocol(self, addr):
+        return WorkerLink(self.arenas, self.factories)
+
+
+def worker(socket_path, argv):
+    options = server.Options()
+    options.parseOptions(argv)
+    # the router decides which arenas exist, none is special here
+    arenas = server.makeArenas(options, keep_default=False)
+    arenas.startService()
+    factories = dict(
+        player=server.PlayerFactory(None, arenas),
+        monitor=server.MonitorFactory(None, arenas))
+    endpoint = UNIXClientEndpoint(reactor, socket_path)
+    d = endpoint.connect(WorkerLinkFactory(arenas, factories))
+
+    def failed(reason):
+        log.err(reason, "can't reach the router")
+        reactor.stop()
+    d.addErrback(failed)
+    # workers go away with the router, whatever stops it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    reactor.run(installSignalHandlers=False)
+
+
+if __name__ == "__main__":
+    log.startLogging(sys.stderr)
+    worker(sys.argv[1], sys.argv[2:])
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 *-*
-import json
+import itertools
+import os
+import time
 
 from twisted.protocols.basic import LineReceiver
 from twisted.internet.protocol import Factory
@@ -8,41 +10,149 @@ from twisted.python import usage, log
 from twisted.internet import reactor
 from twisted.web import static, server
 
-from spacecraft import world, map
+from spacecraft import world, map, codec, stats, arena, budget, inputlog, \
+    recording
 
 
 class ClientBase(LineReceiver):
-    """The base class for clients."""
+    """The base class for clients.
+
+    Everybody starts speaking json. A client can ask for another codec
+    (see codec.codecs) by setting preferred_codec, and it'll switch to it
+    once the server says it accepted it. Both json lines and binary frames
+    are understood at any time, so switching needs no more coordination.
+
+    Servers hosting many games put clients that set arena in the game of
+    that name, see arena.ArenaManager.
+
+    Clients with accept_batches get what the server sends in a tick as a
+    single {"type": "batch", "messages": [...]} message, which is unpacked
+    before it reaches messageReceived.
+
+    Clients setting update_rate get updates that many times per second at
+    most, the events in between still come as they happen.
+    """
     name = 'define a better name bitch. "name" attr in your client'
+    # a batch holds a whole world, lines can be as long as binary frames
+    MAX_LENGTH = codec.BinaryCodec.max_length
+    preferred_codec = codec.JSON.name
+    codec = codec.JSON
+    arena = None
+    accept_batches = True
+    # updates per second to ask for, None gets one every tick
+    update_rate = None
+    _buffer = ''
+    # the pieces of a binary frame still coming in, and the bytes it takes
+    _frame = None
+    _frame_length = 0
+    _frame_received = 0
+
+    def connectionMade(self):
+        if self.arena is not None:
+            self.command("join_arena", value=self.arena)
+        if self.accept_batches:
+            self.command("batches", value=True)
+        if self.update_rate:
+            self.command("update_rate", value=self.update_rate)
+        if self.preferred_codec != self.codec.name:
+            self.command("protocol", value=self.preferred_codec)
 
     def sendName(self):
         self.sendMessage({'type': 'name', 'value': self.name})
 
+    def dataReceived(self, data):
+        if self._frame is not None:
+            # don't copy a big frame over and over while it comes in
+            self._frame.append(data)
+            self._frame_received += len(data)
+            if self._frame_received < self._frame_length:
+                return
+            buf = ''.join(self._frame)
+            self._frame = None
+        else:
+            buf = self._buffer + data
+        header = codec.BinaryCodec.header
+        start = 0
+        while start < len(buf):
+            if buf[start] == '\x00':
+                if len(buf) - start < header.size:
+                    break
+                length, = header.unpack_from(buf, start)
+                if length > self.MAX_LENGTH:
+                    self._buffer = ''
+                    return self.lineLengthExceeded(buf[start:])
+                end = start + header.size + length
+                if len(buf) < end:
+                    self._frame = [buf[start:]]
+                    self._frame_length = end - start
+                    self._frame_received = len(buf) - start
+                    self._buffer = ''
+                    return
+                self.frameReceived(buf[start + header.size:end],
+                    codec.codecs.get(codec.BinaryCodec.name))
+                start = end
+            else:
+                end = buf.find(self.delimiter, start)
+                if end == -1:
+                    if len(buf) - start > self.MAX_LENGTH:
+                        self._buffer = ''
+                        return self.lineLengthExceeded(buf[start:])
+                    break
+                self.lineReceived(buf[start:end])
+                start = end + len(self.delimiter)
+        self._buffer = buf[start:]
+
     def lineReceived(self, line):
+        self.frameReceived(line, codec.JSON)
+
+    def frameReceived(self, data, frame_codec):
+        if frame_codec is None:
+            log.msg("frame in an unsupported codec:", repr(data))
+            return
         try:
-            d = self.decode(line)
+            d = frame_codec.decode(data)
         except ValueError:
-            log.msg("invalid line:", line)
+            log.msg("invalid line:", repr(data))
         else:
-            if d.get('type', '') == 'name please':
-                self.sendName()
-            self.messageReceived(d)
+            self.dispatchMessage(d)
+
+    def dispatchMessage(self, d):
+        if not isinstance(d, dict):
+            log.msg("not a message:", repr(d))
+            return
+        msg_type = d.get('type', '')
+        if msg_type == 'batch':
+            messages = d.get('messages')
+            if not isinstance(messages, list):
+                log.msg("bad batch:", repr(d))
+                return
+            for message in messages:
+                self.dispatchMessage(message)
+            return
+        if msg_type == 'name please':
+            self.sendName()
+        elif msg_type == 'protocol accepted':
+            self.codec = codec.codecs[d['value']]
+        self.messageReceived(d)
 
     def sendMessage(self, *args, **kwargs):
         if args and kwargs:
             raise TypeError("cant use both args and kwargs.")
 
         if args and len(args) == 1:
-            self.sendLine(self.encode(args[0]))
+            self.writeMessage(args[0])
 
         if kwargs:
-            self.sendLine(self.encode(kwargs))
+            self.writeMessage(kwargs)
+
+    def writeMessage(self, message):
+        self.sendData(self.codec.frame(self.encode(message)))
 
-    def decode(self, data):
-        return json.loads(data)
+    def sendData(self, data):
+        self.transport.write(data)
 
     def encode(self, message):
-        return json.dumps(message)
+        return self.codec.encode(message)
 
     def messageReceived(self, message):
         raise NotImplementedError()
@@ -53,12 +163,177 @@ class ClientBase(LineReceiver):
 
 
 class Client(ClientBase):
-    """The server representation of a client."""
+    """The server representation of a client.
+
+    It is the producer of its connection: while the transport has more
+    data buffered than it likes, updates are skipped so the next one sent
+    is the latest state, and only events go out. Clients that get more
+    than max_backlog bytes of those, or don't read anything for
+    stall_timeout seconds, are disconnected.
+
+    During a game tick everything sent is held, and written at once by
+    flush at the end of it; in a single batch for clients that asked.
+
+    Clients that send update_rate get updates only on the ticks that
+    rate asks for, see wantsUpdate.
+    """
+    # what clients send is small, don't let them make us buffer more
+    MAX_LENGTH = 16384
+    accept_batches = False
     name = 'unregistered name'
+    addr = None
+    map = None
+    arenas = None
+    _join_timeout = None
+    clock = reactor
+    max_backlog = 1 << 20
+    stall_timeout = 10
+    paused = False
+    paused_since = None
+    backlog = 0
+    dropped = False
+    batched = False
+    # messages (dicts) and frames (bytes) held until flush, or None
+    pending = None
+    # the game tick of the last update, see wantsUpdate
+    last_update_tick = None
+    # what can be sent before joining a game, anything else waits for it
+    setup_messages = frozenset(["join_arena", "protocol", "batches",
+        "update_rate", "monitor_mode"])
+
+    def connectionMade(self):
+        ClientBase.connectionMade(self)
+        self.transport.registerProducer(self, True)
+
+    def pauseProducing(self):
+        self.paused = True
+        self.paused_since = self.clock.seconds()
+        self.backlog = 0
+
+    def resumeProducing(self):
+        self.paused = False
+
+    def stopProducing(self):
+        pass
+
+    def hold(self):
+        """Keeps whatever is sent from now until flush."""
+        self.pending = []
+
+    def writeMessage(self, message):
+        if self.pending is None:
+            ClientBase.writeMessage(self, message)
+        else:
+            self.pending.append(message)
+
+    def sendData(self, data):
+        if self.pending is None:
+            self.deliver(data)
+        else:
+            self.pending.append(data)
+
+    def flush(self):
+        """Writes everything held since hold, in one go."""
+        pending, self.pending = self.pending, None
+        if not pending:
+            return
+        chunks = []
+        messages = []
+        for item in pending:
+            if isinstance(item, dict):
+                messages.append(item)
+                continue
+            if messages:
+                chunks.append(self.encodeMessages(messages))
+                messages = []
+            chunks.append(item)
+        if messages:
+            chunks.append(self.encodeMessages(messages))
+        self.deliver(''.join(chunks))
+
+    def encodeMessages(self, messages):
+        """Frames for messages, a single batch if the client wants it."""
+        if self.batched and len(messages) > 1:
+            messages = [dict(type="batch", messages=messages)]
+        return ''.join(self.codec.frame(self.encode(message))
+            for message in messages)
+
+    def deliver(self, data):
+        if self.dropped:
+            return
+        if self.paused:
+            self.backlog += len(data)
+            if self.backlog > self.max_backlog:
+                self.drop("too much data waiting")
+                return
+        self.transport.write(data)
+
+    def wantsUpdate(self):
+        """Whether the client gets an update this tick, counting it if so.
+
+        Updates are at least as far apart as the game's send_every and the
+        client's update_rate ask, whichever is longer.
+        """
+        interval = self.map.send_every
+        if self.update_rate:
+            interval = max(interval,
+                int(round(1. / (self.update_rate * self.map.timeStep))))
+        ticks = self.map.ticks
+        if self.last_update_tick is not None and \
+                ticks - self.last_update_tick < interval:
+            return False
+        self.last_update_tick = ticks
+        return True
+
+    def congested(self):
+        """Whether updates should be skipped now."""
+        if self.dropped:
+            return True
+        if not self.paused:
+            return False
+        if self.clock.seconds() - self.paused_since > self.stall_timeout:
+            self.drop("not reading")
+        return True
+
+    def drop(self, why):
+        log.msg("dropping slow client %s: %s" % (self.addr, why))
+        self.dropped = True
+        # whatever is buffered would never get through, don't wait for it
+        self.transport.abortConnection()
 
     def connectionLost(self, reason):
         log.msg("client connection lost:", (self.addr,))
-        self.unregister()
+        if self._join_timeout is not None and self._join_timeout.active():
+            self._join_timeout.cancel()
+        if self.map is not None:
+            self.unregister()
+
+    def waitForArena(self, arenas):
+        """Registers with the arena the client asks for.
+
+        Clients that don't send join_arena in time go to the default one.
+        """
+        self.arenas = arenas
+        self._join_timeout = arenas.clock.callLater(arenas.join_timeout,
+            self.joinArena, None)
+
+    def joinArena(self, name):
+        if self._join_timeout.active():
+            self._join_timeout.cancel()
+        game = self.arenas.get_arena(name)
+        if game is None:
+            self.sendMessage(type="error", value="no room for arena %r" % name)
+            self.transport.loseConnection()
+            return
+        self.sendMessage(type="arena joined",
+            value=name or self.arenas.default)
+        self.register(game)
+
+    def do_join_arena(self, message):
+        if self.arenas is None or self.map is not None:
+            log.msg("Can't join an arena now:", message)
+            return
+        self.joinArena(message.get("value"))
 
     def unregister(self):
         self.map.unregister_client(self)
@@ -71,6 +346,8 @@ class Client(ClientBase):
         pass
 
     def sendUpdate(self):
+        if self.congested():
+            return
         self.sendMessage(type="time", step=self.map.step)
 
     def messageReceived(self, message):
@@ -82,9 +359,36 @@ class Client(ClientBase):
         if meth is None:
             log.msg("Unknown message type:", msg_type)
             return
+        if msg_type not in self.setup_messages and not self.joined():
+            log.msg("Not in a game yet, ignoring:", message)
+            return
 
         meth(message)
 
+    def joined(self):
+        """Whether the client is in a game its messages can act on."""
+        return self.map is not None
+
+    def do_batches(self, message):
+        self.batched = bool(message.get("value"))
+
+    def do_update_rate(self, message):
+        rate = message.get("value")
+        if rate is not None and not (isinstance(rate, (int, float)) and
+                rate > 0):
+            log.msg("Bad update rate message:", message)
+            return
+        self.update_rate = rate
+
+    def do_protocol(self, message):
+        wanted = codec.codecs.get(message.get("value"))
+        if wanted is None:
+            log.msg("Unsupported protocol:", message)
+            wanted = self.codec
+        # this still goes out in the old codec, anything after in the new one
+        self.sendMessage(type="protocol accepted", value=wanted.name)
+        self.codec = wanted
+
     def sendHello(self):
         if self.transport:
             m = self.map.get_map_description()
@@ -93,13 +397,18 @@ class Client(ClientBase):
 
 
 class ClientFactory(Factory):
-    def __init__(self, map):
+    def __init__(self, map, arenas=None):
         self.map = map
+        # an arena.ArenaManager, when clients get to choose their game
+        self.arenas = arenas
 
     def buildProtocol(self, addr):
         log.msg("Client connected from:", (addr,))
         protocol = Factory.buildProtocol(self, addr)
-        protocol.register(self.map)
+        if self.arenas is None:
+            protocol.register(self.map)
+        else:
+            protocol.waitForArena(self.arenas)
         protocol.addr = addr
         return protocol
 
@@ -113,8 +422,13 @@ class Player(Client):
         self.object = world.PlayerObject(self.map)
         reactor.callLater(0, self.sendHello)
 
+    def joined(self):
+        # the ship comes a moment after the game
+        return Client.joined(self) and hasattr(self, 'object')
+
     def unregister(self):
         Client.unregister(self)
+        self.map.record("leave", id=self.object.get_id())
         self.object.destroy()
 
     def do_throttle(self, message):
@@ -123,6 +437,8 @@ class Player(Client):
             log.msg("Bad throttle message:", message)
 
         self.object.throttle = max(0, min(1, value))
+        self.map.record("throttle", id=self.object.get_id(),
+            value=self.object.throttle)
 
     def do_turn(self, message):
         value = message.get("value", 0)
@@ -130,19 +446,26 @@ class Player(Client):
             log.msg("Bad turn message:", message)
 
         self.object.turn = max(-1, min(1, value))
+        self.map.record("turn", id=self.object.get_id(),
+            value=self.object.turn)
 
     def do_fire(self, message):
         self.object.fire = 1
+        self.map.record("fire", id=self.object.get_id())
 
     def sendUpdate(self):
+        if self.congested():
+            return
         if hasattr(self, 'object'):
-            self.sendMessage(type="sensor", **self.object.getReadings())
+            readings = self.map.timed('sensors', self.object.getReadings)
+            self.sendMessage(type="sensor", **readings)
         self.sendMessage(type="time", step=self.map.step)
 
     def do_name(self, msg):
         name = msg['value']
         self.object.name = name # so nobody complains
         self.object.map.register_client_name(self.object, name)
+        self.map.record("name", id=self.object.get_id(), value=name)
 
     def sendHello(self):
         Client.sendHello(self)
@@ -154,19 +477,100 @@ class PlayerFactory(ClientFactory):
     protocol = Player
 
 
+def diff_snapshots(old, new):
+    """Compare two world snapshots.
+
+    Returns the records that were created, the fields that changed for
+    the rest, and the ids of the objects that are gone.
+    """
+    created = []
+    changed = []
+    for object_id, record in new.iteritems():
+        previous = old.get(object_id)
+        if previous is None or \
+                previous['object_type'] != record['object_type']:
+            created.append(dict(record, id=object_id))
+            continue
+        fields = dict((key, value) for key, value in record.iteritems()
+            if previous.get(key) != value)
+        if fields:
+            fields['id'] = object_id
+            changed.append(fields)
+    destroyed = [object_id for object_id in old if object_id not in new]
+    return created, changed, destroyed
+
+
 class Monitor(Client):
+    # "full" sends every body every tick, "delta" sends a keyframe every
+    # keyframe_interval ticks and only what changed in between.
+    mode = "full"
+    keyframe_interval = 20
+    # the tick of the last frame sent in delta mode
+    last_tick = None
 
     def register(self, map):
         Client.register(self, map)
-        reactor.callLater(0, self.sendHello)
+        self.clock.callLater(0, self.sendHello)
+
+    def do_monitor_mode(self, message):
+        mode = message.get("value")
+        if mode not in ("full", "delta"):
+            log.msg("Bad monitor mode message:", message)
+            return
+        self.mode = mode
+        self.last_tick = None
 
     def sendUpdate(self):
-        for body in self.map.world.bodies:
-            self.sendMessage(dict(
-                type="monitor",
-                object_type=body.userData.get_type(),
-                **body.userData.get_monitor_data()))
-        self.sendMessage(type="time", step=self.map.step)
+        # frames skipped here are coalesced for free: the next one is the
+        # whole state, or a delta from the last one sent
+        if self.congested():
+            return
+        # every monitor gets the same bytes, so encode them once per tick
+        if self.mode == "delta":
+            frame = self.deltaFrame()
+        else:
+            frame = self.map.cached(
+                ('monitor frame', self.codec.name, self.batched),
+                self.buildFrame)
+        self.sendData(frame)
+
+    def deltaFrame(self):
+        game = self.map
+        game.get_snapshot()
+        base = self.last_tick
+        self.last_tick = game.ticks
+        # a keyframe on every multiple of keyframe_interval, or on the
+        # first update after it for monitors that skip ticks
+        if base not in game.snapshots or base // self.keyframe_interval != \
+                game.ticks // self.keyframe_interval:
+            return game.cached(
+                ('monitor keyframe', self.codec.name, self.batched),
+                self.buildKeyframe)
+        return game.cached(
+            ('monitor delta', self.codec.name, self.batched, base),
+            lambda: self.buildDelta(base))
+
+    def buildKeyframe(self):
+        objects = [dict(record, id=object_id)
+            for object_id, record in self.map.get_snapshot().iteritems()]
+        return self.encodeMessages([
+            dict(type="monitor_keyframe", objects=objects),
+            dict(type="time", step=self.map.step)])
+
+    def buildDelta(self, base):
+        created, changed, destroyed = diff_snapshots(
+            self.map.snapshots[base], self.map.get_snapshot())
+        return self.encodeMessages([
+            dict(type="monitor_delta", created=created, changed=changed,
+                destroyed=destroyed),
+            dict(type="time", step=self.map.step)])
+
+    def buildFrame(self):
+        """Encode the whole world state as a single block of lines."""
+        messages = [dict(record, type="monitor")
+            for record in self.map.get_snapshot().itervalues()]
+        messages.append(dict(type="time", step=self.map.step))
+        return self.encodeMessages(messages)
 
     def do_start_game(self, message):
         self.map.start_game()
@@ -194,33 +598,104 @@ class Options(usage.Options):
             bool],
         ["map", "", "",
             "Start with this map.", str],
+        ["arenas", "a", 1,
+            "How many games to host at once, clients pick theirs by name.",
+            int],
+        ["workers", "w", 0,
+            "Run the games in this many processes, each hosting up to "
+            "--arenas of them. 0 runs them in this one.", int],
+        ["frames", "f", 20,
+            "How many ticks the games take per second.", int],
+        ["veliters", None, 10,
+            "Velocity iterations of the physics solver each tick.", int],
+        ["positers", None, 10,
+            "Position iterations of the physics solver each tick.", int],
+        ["seed", None, None,
+            "Seed the random numbers of the games with this.", int],
+        ["record", None, None,
+            "Write an input log of every game to this directory, see "
+            "spacecraft.inputlog."],
+        ["archive", None, None,
+            "Write a compact recording of every game to this directory, see "
+            "spacecraft.recording."],
 
         ]
 
+    optFlags = [
+        ["stats", None,
+            "Time each phase of the game ticks, see /stats on the http port."],
+        ["adaptive", None,
+            "Lower the solver iterations, then how often clients get "
+            "updates, when ticks take close to their time."],
+        ]
 
-def makeService(options):
-    root_service = service.MultiService()
 
-    game = world.Game(options["xsize"], options["ysize"],
-        start=options["start"])
+def makeArenas(options, **kwargs):
+    """An arena.ArenaManager making games as options say."""
     if options["map"]:
         maploader = map.MapLoader(options["map"])
-        maploader.setup_map(game)
+    games = itertools.count(1)
+
+    def make_game():
+        game = world.Game(options["xsize"], options["ysize"],
+            frames=options["frames"], start=options["start"],
+            vel_iters=options["veliters"], pos_iters=options["positers"],
+            seed=options["seed"])
+        if options["map"]:
+            maploader.setup_map(game)
+        if options["stats"]:
+            game.stats = stats.TickStats(game.timeStep)
+        if options["adaptive"]:
+            game.budget = budget.TickBudget(game.timeStep,
+                game.vel_iters, game.pos_iters)
+        # the log and the recording of a game go by the same name
+        name = "%s-%s-%d" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid(),
+            next(games))
+        if options["record"]:
+            inputlog.InputLog(game,
+                open(os.path.join(options["record"], name + ".log"), 'w'),
+                options["map"] or None)
+        if options["archive"]:
+            recording.Recorder(game,
+                open(os.path.join(options["archive"], name + ".rec"), 'wb'))
+        return game
+
+    return arena.ArenaManager(make_game, options["arenas"],
+        frames=options["frames"], **kwargs)
+
+
+def makeService(options):
+    if options["workers"]:
+        # the router imports this module
+        from spacecraft import router
+        return router.makeService(options)
+
+    root_service = service.MultiService()
 
-    game.setServiceParent(root_service)
+    arenas = makeArenas(options)
+    arenas.setServiceParent(root_service)
+    game = arenas.get_arena()
+    # with a single game there is nothing to choose, don't make anybody wait
+    if options["arenas"] <= 1:
+        choice = None
+    else:
+        choice = arenas
 
     monitor_service = internet.TCPServer(
-        options['monitorport'], MonitorFactory(game))
+        options['monitorport'], MonitorFactory(game, choice))
     monitor_service.setName("monitors")
     monitor_service.setServiceParent(root_service)
 
     player_service = internet.TCPServer(
-        options['playerport'], PlayerFactory(game))
+        options['playerport'], PlayerFactory(game, choice))
     player_service.setName("players")
     player_service.setServiceParent(root_service)
 
     # add web service
     root_resource = static.File("static/")
+    if options["stats"]:
+        root_resource.putChild("stats", stats.ArenaStatsResource(arenas))
+    root_resource.putChild("arenas", arena.ArenaResource(arenas))
     site = server.Site(root_resource)
     web_service = internet.TCPServer(options['httpport'], site)
     web_service.setServiceParent(root_service)
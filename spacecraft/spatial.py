@@ -0,0 +1,209 @@
+# -*- coding: utf-8 *-*
+"""Spatial indexes over the bodies of a world, built once per tick."""
+import Box2D
+import numpy
+
+
+def body_positions(bodies):
+    """Returns the objects of bodies and an array with their positions."""
+    objects = []
+    coords = []
+    for body in bodies:
+        objects.append(body.userData)
+        coords.extend(body.position)
+    return objects, numpy.array(coords, dtype=float).reshape(-1, 2)
+
+
+class ProximityGrid(object):
+    """Bins positions in a uniform grid to answer radius queries.
+
+    The map wraps around, so cells on one edge are neighbours of the cells
+    on the opposite edge and distances are measured the short way around.
+    """
+
+    def __init__(self, objects, positions, xsize, ysize, cell_size):
+        self.objects = objects
+        self.positions = positions
+        self.size = numpy.array([xsize, ysize], dtype=float)
+        self.columns = max(1, int(xsize // cell_size))
+        self.rows = max(1, int(ysize // cell_size))
+        self.cell_width = float(xsize) / self.columns
+        self.cell_height = float(ysize) / self.rows
+
+        columns, rows = self.cells(positions)
+        keys = columns * self.rows + rows
+        # objects sorted by cell, and where each cell starts in that order
+        self.order = numpy.argsort(keys, kind='mergesort')
+        self.starts = numpy.searchsorted(keys[self.order],
+            numpy.arange(self.columns * self.rows + 1))
+
+    @classmethod
+    def from_bodies(cls, bodies, xsize, ysize, cell_size):
+        objects, positions = body_positions(bodies)
+        return cls(objects, positions, xsize, ysize, cell_size)
+
+    def cells(self, positions):
+        columns = numpy.floor(positions[:, 0] / self.cell_width)
+        rows = numpy.floor(positions[:, 1] / self.cell_height)
+        return (columns.astype(int) % self.columns,
+            rows.astype(int) % self.rows)
+
+    def neighbours(self, index, reach, count):
+        """The indexes of the cells up to reach cells away from index."""
+        if 2 * reach + 1 >= count:
+            return range(count)
+        return [(index + offset) % count for offset in range(-reach, reach + 1)]
+
+    def query(self, center, radius):
+        """Returns the objects closer than radius to center."""
+        x, y = center
+        column = int(x // self.cell_width) % self.columns
+        row = int(y // self.cell_height) % self.rows
+        columns = self.neighbours(column,
+            int(numpy.ceil(radius / self.cell_width)), self.columns)
+        rows = self.neighbours(row,
+            int(numpy.ceil(radius / self.cell_height)), self.rows)
+
+        starts = self.starts
+        chunks = []
+        for c in columns:
+            for r in rows:
+                key = c * self.rows + r
+                if starts[key] != starts[key + 1]:
+                    chunks.append(self.order[starts[key]:starts[key + 1]])
+        if not chunks:
+            return []
+        candidates = numpy.concatenate(chunks)
+
+        delta = numpy.abs(self.positions[candidates] - (x, y))
+        delta = numpy.minimum(delta, self.size - delta)
+        near = candidates[(delta ** 2).sum(axis=1) < radius ** 2]
+        return [self.objects[i] for i in numpy.sort(near)]
+
+
+_directions = {}
+
+
+def ray_directions(steps):
+    """Unit vectors for steps rays evenly spread around a full turn."""
+    if steps not in _directions:
+        angles = numpy.arange(steps) * (2 * numpy.pi / steps)
+        _directions[steps] = numpy.column_stack(
+            (numpy.cos(angles), numpy.sin(angles)))
+    return _directions[steps]
+
+
+class ShapeIndex(object):
+    """The circles and axis aligned boxes of every fixture in a world.
+
+    Casts many rays at once against all of them. Like Box2D, a ray does
+    not hit a shape that contains its origin.
+    """
+
+    def __init__(self, circle_objects, circles, box_objects, boxes):
+        # circles are rows of (x, y, radius)
+        self.circle_objects = circle_objects
+        self.circles = circles
+        # boxes are rows of (left, bottom, right, top)
+        self.box_objects = box_objects
+        self.boxes = boxes
+
+    @classmethod
+    def from_bodies(cls, bodies):
+        circle_objects = []
+        circles = []
+        box_objects = []
+        boxes = []
+        for body in bodies:
+            for fixture in body.fixtures:
+                shape = fixture.shape
+                if isinstance(shape, Box2D.b2CircleShape):
+                    x, y = body.GetWorldPoint(shape.pos)
+                    circle_objects.append(body.userData)
+                    circles.extend((x, y, shape.radius))
+                else:
+                    # walls are axis aligned, anything else gets its bounds
+                    points = [body.GetWorldPoint(v) for v in shape.vertices]
+                    xs = [p[0] for p in points]
+                    ys = [p[1] for p in points]
+                    box_objects.append(body.userData)
+                    boxes.extend((min(xs), min(ys), max(xs), max(ys)))
+        return cls(circle_objects,
+            numpy.array(circles, dtype=float).reshape(-1, 3),
+            box_objects,
+            numpy.array(boxes, dtype=float).reshape(-1, 4))
+
+    def circle_hits(self, origin, rays):
+        """Fraction of each ray where it hits each circle, inf for misses."""
+        centers = self.circles[:, :2]
+        radius = self.circles[:, 2]
+        s = origin - centers
+        b = (s ** 2).sum(axis=1) - radius ** 2
+        # skip circles out of reach, and those containing the origin
+        reach = numpy.sqrt((rays[0] ** 2).sum())
+        near = (b > 0) & (numpy.sqrt(b + radius ** 2) - radius <= reach)
+        s, b = s[near], b[near]
+        c = numpy.dot(rays, s.T)
+        rr = (rays ** 2).sum(axis=1)[:, numpy.newaxis]
+        sigma = c ** 2 - rr * b
+        with numpy.errstate(invalid='ignore'):
+            a = -(c + numpy.sqrt(sigma))
+            hit = (sigma >= 0) & (a >= 0) & (a <= rr)
+        fractions = numpy.where(hit, a / rr, numpy.inf)
+        return numpy.nonzero(near)[0], fractions
+
+    def box_hits(self, origin, rays):
+        """Fraction of each ray where it hits each box, inf for misses."""
+        lower = self.boxes[:, :2] - origin
+        upper = self.boxes[:, 2:] - origin
+        # skip the boxes containing the origin
+        near = numpy.nonzero(~((lower < 0) & (upper > 0)).all(axis=1))[0]
+        lower, upper = lower[near], upper[near]
+
+        entry = numpy.zeros((len(rays), len(near)))
+        leave = numpy.ones((len(rays), len(near)))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            for axis in (0, 1):
+                d = rays[:, axis][:, numpy.newaxis]
+                t1 = lower[:, axis] / d
+                t2 = upper[:, axis] / d
+                # rays parallel to this axis only hit within the slab, out
+                # of it they enter and leave at infinity, so never
+                parallel = d == 0
+                within = (lower[:, axis] <= 0) & (upper[:, axis] >= 0)
+                t1 = numpy.where(parallel,
+                    numpy.where(within, -numpy.inf, numpy.inf), t1)
+                t2 = numpy.where(parallel, numpy.inf, t2)
+                entry = numpy.maximum(entry, numpy.minimum(t1, t2))
+                leave = numpy.minimum(leave, numpy.maximum(t1, t2))
+        hit = (entry <= leave) & (entry > 0)
+        return near, numpy.where(hit, entry, numpy.inf)
+
+    def cast(self, origin, directions, length):
+        """Returns the objects hit first by each ray, without repetitions.
+
+        The rays start at origin and go length units in directions. Objects
+        come once, however many of their fixtures were hit, nearest first.
+        """
+        origin = numpy.asarray(origin, dtype=float)
+        rays = directions * length
+        circles, circle_fractions = self.circle_hits(origin, rays)
+        boxes, box_fractions = self.box_hits(origin, rays)
+        objects = [self.circle_objects[i] for i in circles] + \
+            [self.box_objects[i] for i in boxes]
+        if not objects:
+            return []
+        fractions = numpy.hstack((circle_fractions, box_fractions))
+        closest = fractions.argmin(axis=1)
+        nearest = fractions[numpy.arange(len(rays)), closest]
+        hit = numpy.isfinite(nearest)
+        # id of the object -> (fraction of its nearest hit, object)
+        found = {}
+        for index, fraction in zip(closest[hit].tolist(),
+                nearest[hit].tolist()):
+            obj = objects[index]
+            key = id(obj)
+            if key not in found or fraction < found[key][0]:
+                found[key] = (fraction, obj)
+        return [obj for fraction, obj in sorted(found.values(),
+            key=lambda pair: pair[0])]
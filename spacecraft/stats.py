@@ -0,0 +1,154 @@
+# -*- coding: utf-8 *-*
+"""Where does the time of each game tick go.
+
+Enable it by setting Game.stats to a TickStats. The server does that with
+--stats and serves the summary as json at /stats on the http port, and
+that of each arena at /stats/<arena>. With --workers, the workers send
+theirs to the router along with their load, and the router serves them.
+"""
+import json
+from timeit import default_timer
+
+from twisted.web import resource
+
+
+class Histogram(object):
+    """Counts samples (in seconds) in buckets of growing size."""
+    # upper bounds of the buckets, in milliseconds
+    bounds = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        for i, bound in enumerate(self.bounds):
+            if ms <= bound:
+                break
+        else:
+            i = len(self.bounds)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def summary(self):
+        """Times are in milliseconds, buckets are [upper bound, count]."""
+        return dict(
+            count=self.count,
+            total=self.total,
+            mean=self.total / self.count if self.count else 0.0,
+            max=self.max,
+            buckets=[[bound, count] for bound, count in
+                zip(self.bounds + (None,), self.counts)])
+
+
+class TickStats(object):
+    """Timings of each phase of the ticks of a game.
+
+    The game calls start_tick, then lap after each of its phases, and
+    end_tick. Work done on behalf of another phase (like sensor readings
+    while sending updates) is reported with add and not counted as part
+    of the phase it happened in.
+    """
+    phases = ('execute', 'physics', 'contacts', 'wraparound', 'sensors',
+        'send', 'record')
+
+    def __init__(self, time_step):
+        self.time_step = time_step
+        self.tick = Histogram()
+        self.histograms = dict((phase, Histogram()) for phase in self.phases)
+        self.ticks = 0
+        self.overruns = 0
+        self.bodies = 0
+        self.clients = 0
+        self.started = self.last_lap = None
+        self.nested = {}
+
+    def start_tick(self):
+        self.started = self.last_lap = default_timer()
+        self.nested = {}
+
+    def add(self, phase, seconds):
+        self.nested[phase] = self.nested.get(phase, 0) + seconds
+
+    def lap(self, phase):
+        now = default_timer()
+        spent = now - self.last_lap - sum(self.nested.values())
+        self.histograms[phase].add(spent)
+        for nested, seconds in self.nested.iteritems():
+            self.histograms[nested].add(seconds)
+        self.nested = {}
+        self.last_lap = now
+
+    def end_tick(self, bodies, clients):
+        duration = default_timer() - self.started
+        self.tick.add(duration)
+        self.ticks += 1
+        if duration > self.time_step:
+            self.overruns += 1
+        self.bodies = bodies
+        self.clients = clients
+
+    def summary(self):
+        return dict(
+            ticks=self.ticks,
+            overruns=self.overruns,
+            time_step=self.time_step * 1000,
+            bodies=self.bodies,
+            clients=self.clients,
+            tick=self.tick.summary(),
+            phases=dict((phase, histogram.summary())
+                for phase, histogram in self.histograms.iteritems()))
+
+
+def game_summary(game):
+    """The summary of the TickStats of game.
+
+    With a TickBudget the game's current level comes too, under "budget".
+    """
+    summary = game.stats.summary()
+    if game.budget is not None:
+        summary['budget'] = game.budget.summary()
+    return summary
+
+
+class StatsResource(resource.Resource):
+    """Serves the game_summary of a game as json."""
+    isLeaf = True
+
+    def __init__(self, game):
+        resource.Resource.__init__(self)
+        self.game = game
+
+    def render_GET(self, request):
+        request.setHeader('content-type', 'application/json')
+        return json.dumps(game_summary(self.game))
+
+
+class ArenaStatsResource(resource.Resource):
+    """Serves the TickStats of each arena of an arena.ArenaManager.
+
+    /stats/<arena> has those of an arena, /stats those of the default one.
+    """
+
+    def __init__(self, arenas):
+        resource.Resource.__init__(self)
+        self.arenas = arenas
+
+    def getChild(self, name, request):
+        if not name:
+            return self
+        game = self.arenas.arenas.get(name)
+        if game is None or game.stats is None:
+            return resource.NoResource("No such arena.")
+        return StatsResource(game)
+
+    def render_GET(self, request):
+        game = self.arenas.arenas.get(self.arenas.default)
+        if game is None or game.stats is None:
+            return resource.NoResource("No such arena.").render(request)
+        return StatsResource(game).render_GET(request)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 *-*
+import json
+
+from mock import Mock
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from spacecraft import arena, server, world
+
+
+class TestArenaManager(TestCase):
+
+    def setUp(self):
+        self.manager = arena.ArenaManager(lambda: Mock(clients=[]),
+            max_arenas=3)
+        self.manager.clock = task.Clock()
+
+    def test_get_arena(self):
+        default = self.manager.get_arena()
+        self.assertIs(self.manager.get_arena("default"), default)
+        red = self.manager.get_arena("red")
+        self.assertIsNot(red, default)
+        self.assertIs(self.manager.get_arena("red"), red)
+        self.manager.get_arena("blue")
+        self.assertIs(self.manager.get_arena("green"), None)
+
+    def test_prune(self):
+        red = self.manager.get_arena("red")
+        blue = self.manager.get_arena("blue")
+        red.clients = [object()]
+        self.manager.prune()
+        self.assertEqual(["default", "red"], self.manager.arenas.keys())
+
+    def test_turns(self):
+        order = []
+        for name in ("default", "red", "blue"):
+            game = self.manager.get_arena(name)
+            game.clients = [object()]
+            game.doStep.side_effect = lambda name=name: order.append(name)
+        self.manager.startService()
+        for i in range(3):
+            self.manager.clock.advance(self.manager.time_step)
+        self.manager.stopService()
+        self.assertEqual(["default", "red", "blue",
+            "red", "blue", "default",
+            "blue", "default", "red"], order[:9])
+
+
+class TestJoinArena(TestCase):
+
+    def setUp(self):
+        self.arenas = arena.ArenaManager(lambda: world.Game(100, 100),
+            max_arenas=2)
+        self.arenas.clock = task.Clock()
+        factory = server.ClientFactory(self.arenas.get_arena(), self.arenas)
+        factory.protocol = server.Client
+        self.client = factory.buildProtocol(("127.0.0.1", 0))
+        self.transport = StringTransport()
+        self.client.makeConnection(self.transport)
+
+    def send(self, **message):
+        self.client.dataReceived(json.dumps(message) + "\r\n")
+
+    def received(self):
+        return [json.loads(line)
+            for line in self.transport.value().splitlines()]
+
+    def test_join(self):
+        self.assertIs(self.client.map, None)
+        self.send(type="join_arena", value="red")
+        red = self.arenas.arenas["red"]
+        self.assertIs(self.client.map, red)
+        self.assertTrue(self.client in red.clients)
+        self.assertEqual([dict(type="arena joined", value="red")],
+            self.received())
+        # too late to go anywhere else
+        self.arenas.clock.advance(self.arenas.join_timeout)
+        self.send(type="join_arena", value="blue")
+        self.assertIs(self.client.map, red)
+
+    def test_default(self):
+        self.arenas.clock.advance(self.arenas.join_timeout)
+        self.assertIs(self.client.map, self.arenas.get_arena())
+        self.assertEqual([dict(type="arena joined", value="default")],
+            self.received())
+
+    def test_full(self):
+        self.arenas.get_arena("red")
+        self.send(type="join_arena", value="blue")
+        self.assertIs(self.client.map, None)
+        self.assertEqual("error", self.received()[0]["type"])
+        self.assertTrue(self.transport.disconnecting)
+
+    def test_disconnect_while_waiting(self):
+        self.client.connectionLost(None)
+        self.assertEqual([], self.arenas.clock.getDelayedCalls())
+
+    def test_messages_before_joining(self):
+        factory = server.ClientFactory(None, self.arenas)
+        for protocol in (server.Player, server.Monitor):
+            factory.protocol = protocol
+            client = factory.buildProtocol(("127.0.0.1", 0))
+            client.makeConnection(StringTransport())
+            for kind in ("start_game", "throttle", "turn", "fire", "name"):
+                client.messageReceived(dict(type=kind, value=1))
+            client.messageReceived(dict(type="update_rate", value=5))
+            self.assertEqual(5, client.update_rate)
+            client.connectionLost(None)
+        self.assertEqual(world.STATUS_WAITING, self.arenas.get_arena().status)
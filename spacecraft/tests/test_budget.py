@@ -0,0 +1,64 @@
+# -*- coding: utf-8 *-*
+from mock import Mock
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from spacecraft import budget, server, world
+
+
+class TestTickBudget(TestCase):
+
+    def setUp(self):
+        self.game = world.Game(10, 10, frames=10)
+        self.budget = budget.TickBudget(self.game.timeStep)
+        self.budget.smoothing = 1
+
+    def test_levels(self):
+        self.assertEqual([(10, 10, 1), (5, 5, 1), (2, 2, 1), (2, 2, 2),
+            (2, 2, 3), (2, 2, 4)], self.budget.levels)
+
+    def test_levels_keep_lower_iterations(self):
+        levels = budget.TickBudget(0.1, vel_iters=8, pos_iters=1).levels
+        self.assertEqual([(8, 1, 1), (4, 1, 1), (2, 1, 1)],
+            levels[:3])
+
+    def ticks(self, seconds, count):
+        for i in range(count):
+            self.budget.end_tick(self.game, seconds)
+
+    def test_slow_ticks(self):
+        self.ticks(0.09, self.budget.patience - 1)
+        self.assertEqual(10, self.game.vel_iters)
+        self.ticks(0.09, 1)
+        self.assertEqual((5, 5, 1), (self.game.vel_iters,
+            self.game.pos_iters, self.game.send_every))
+        self.ticks(0.09, self.budget.patience * 10)
+        self.assertEqual((2, 2, 4), (self.game.vel_iters,
+            self.game.pos_iters, self.game.send_every))
+
+    def test_recover(self):
+        self.ticks(0.09, self.budget.patience * 3)
+        self.assertEqual(3, self.budget.level)
+        # in between, nothing changes
+        self.ticks(0.06, self.budget.patience * 3)
+        self.assertEqual(3, self.budget.level)
+        self.ticks(0.01, self.budget.patience)
+        self.assertEqual((2, 2, 1), (self.game.vel_iters,
+            self.game.pos_iters, self.game.send_every))
+
+    def test_send_every(self):
+        self.game.send_every = 2
+        client = server.Client()
+        client.makeConnection(StringTransport())
+        client.register(self.game)
+        sent = []
+        for i in range(5):
+            self.game.doStep()
+            sent.append(bool(client.transport.value()))
+            client.transport.clear()
+        self.assertEqual([True, False, True, False, True], sent)
+
+    def test_do_step(self):
+        self.game.budget = Mock()
+        self.game.doStep()
+        self.game.budget.end_tick.assert_called_once()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 *-*
+from unittest import TestCase
+
+from spacecraft import headless, server, world
+
+
+class Shooter(server.ClientBase):
+    name = 'shooter'
+
+    def messageReceived(self, message):
+        if message.get('type') == 'sensor':
+            self.command('fire')
+
+
+class Duck(server.ClientBase):
+    name = 'duck'
+
+    def __init__(self):
+        self.received = []
+
+    def messageReceived(self, message):
+        self.received.append(message)
+
+
+class Quitter(Duck):
+    name = 'quitter'
+
+    def messageReceived(self, message):
+        if message.get('type') == 'sensor':
+            self.transport.loseConnection()
+
+
+class TestMatch(TestCase):
+
+    def make_match(self, *bots):
+        match = headless.Match(bots)
+        # face each other, far from the powerups' reach
+        for i, player in enumerate(match.players):
+            player.object.body.position = (40 + 20 * i, 50)
+            player.object.body.angle = 0 if i == 0 else 3.14159
+        return match
+
+    def test_bots_get_named(self):
+        duck = Duck()
+        match = self.make_match(Shooter(), duck)
+        self.assertEqual(['shooter', 'duck'],
+            [player.object.name for player in match.players])
+        self.assertTrue('map_description' in
+            [m['type'] for m in duck.received])
+
+    def test_run_until_someone_wins(self):
+        match = self.make_match(Shooter(), Duck())
+        results = match.run(max_steps=5000)
+        self.assertEqual(world.STATUS_FINISHED, match.game.status)
+        self.assertEqual('shooter', match.game.winner.name)
+        self.assertEqual(['shooter', 'duck'], [r[2] for r in results])
+
+    def test_run_stops_at_max_steps(self):
+        match = self.make_match(Duck(), Duck())
+        results = match.run(max_steps=10)
+        self.assertEqual(10, match.game.step)
+        self.assertEqual(2, len(results))
+
+    def test_disconnect(self):
+        match = self.make_match(Quitter(), Duck())
+        match.game.start_game()
+        match.game.doStep()
+        self.assertEqual(1, len(match.game.players))
+        self.assertEqual(1, len(match.game.clients))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 *-*
+import json
+from StringIO import StringIO
+from unittest import TestCase
+
+from spacecraft import headless, inputlog, server, world
+
+
+class Pilot(server.ClientBase):
+    name = 'pilot'
+
+    def __init__(self):
+        self.steps = 0
+
+    def messageReceived(self, message):
+        if message.get('type') != 'sensor':
+            return
+        self.steps += 1
+        self.command('throttle', value=1)
+        self.command('turn', value=(self.steps % 7) / 7. - 0.5)
+        if self.steps % 3 == 0:
+            self.command('fire')
+
+
+class Log(StringIO):
+    # the match closes it when it's done
+    def close(self):
+        self.closed_value = self.getvalue()
+
+
+class TestInputLog(TestCase):
+
+    def record(self, steps=300):
+        out = Log()
+        match = headless.Match([Pilot(), Pilot()], seed=42, record=out)
+        results = match.run(max_steps=steps)
+        return match.game, results, out.closed_value.splitlines()
+
+    def test_same_seed(self):
+        first = world.Game(100, 100, seed=3)
+        second = world.Game(100, 100, seed=3)
+        self.assertEqual(inputlog.checksum(first),
+            inputlog.checksum(second))
+        self.assertNotEqual(inputlog.checksum(first),
+            inputlog.checksum(world.Game(100, 100, seed=4)))
+
+    def test_log(self):
+        game, results, lines = self.record(10)
+        entries = [json.loads(line) for line in lines]
+        self.assertEqual(42, entries[0]['seed'])
+        kinds = [entry['type'] for entry in entries]
+        self.assertEqual(['header', 'join', 'name', 'join', 'name',
+            'start_game'], kinds[:6])
+        self.assertTrue('throttle' in kinds)
+        self.assertTrue('fire' in kinds)
+        self.assertEqual('end', kinds[-1])
+
+    def test_replay(self):
+        game, results, lines = self.record()
+        replay = inputlog.Replay(lines)
+        replayed = replay.run()
+        self.assertEqual(3, replay.checksums)
+        self.assertEqual(game.step, replayed.step)
+        self.assertEqual(results, replayed.get_results())
+        self.assertEqual(inputlog.checksum(game),
+            inputlog.checksum(replayed))
+
+    def test_replay_diverges(self):
+        game, results, lines = self.record()
+        # somebody didn't fire when they did
+        fire = [i for i, line in enumerate(lines) if '"fire"' in line]
+        del lines[fire[0]]
+        self.assertRaises(inputlog.ReplayError,
+            inputlog.Replay(lines).run)
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 *-*
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from spacecraft import map, recording, world
+
+CROSS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+    'maps', 'cross.svg')
+
+
+class TestRecording(TestCase):
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix='.rec')
+        os.close(fd)
+        self.game = world.Game(200, 200, start=True, seed=1)
+        map.MapLoader(CROSS).setup_map(self.game)
+        self.players = [world.PlayerObject(self.game) for i in range(4)]
+        self.players[0].name = 'first'
+        self.recorder = recording.Recorder(self.game, open(self.path, 'wb'),
+            chunk_ticks=100)
+        # tick -> what a monitor would have got then
+        self.snapshots = {}
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def play(self, ticks):
+        for i in range(ticks):
+            for player in self.players:
+                player.throttle = 1
+                player.turn = 0.3
+                player.fire = 1
+            self.game.doStep()
+            self.snapshots[self.game.ticks] = json.loads(
+                json.dumps(self.game.get_snapshot()))
+
+    def assertSameRecords(self, expected, records):
+        self.assertEqual(sorted(int(i) for i in expected), sorted(records))
+        for object_id, record in records.iteritems():
+            wanted = expected[str(object_id)]
+            self.assertEqual(sorted(wanted), sorted(record))
+            self.assertEqual(wanted['object_type'], record['object_type'])
+            for key in ('position', 'velocity'):
+                for a, b in zip(wanted[key], record[key]):
+                    self.assertAlmostEqual(a, b, delta=abs(a) * 1e-6 + 1e-6)
+            self.assertAlmostEqual(wanted['angle'], record['angle'], 5)
+
+    def test_read_back(self):
+        self.play(250)
+        self.recorder.close()
+        self.assertIs(self.game.recorder, None)
+        reader = recording.Recording(self.path)
+        self.assertEqual([1, 101, 201],
+            [first for first, ticks, offset in reader.index])
+        self.assertEqual((1, 250), (reader.first_tick, reader.last_tick))
+        self.assertEqual(self.game.get_map_description(),
+            reader.header['map'])
+        for tick in (1, 100, 101, 199, 250):
+            step, records = reader.records(tick)
+            self.assertEqual(tick, step)
+            self.assertSameRecords(self.snapshots[tick], records)
+        step, records = reader.records(7)
+        self.assertEqual('first', records[self.players[0].get_id()]['name'])
+        self.assertRaises(IndexError, reader.records, 251)
+        reader.close()
+
+    def test_not_closed(self):
+        self.play(150)
+        reader = recording.Recording(self.path)
+        # only what was flushed, one whole chunk
+        self.assertEqual((1, 100), (reader.first_tick, reader.last_tick))
+        step, records = reader.records(100)
+        self.assertSameRecords(self.snapshots[100], records)
+        reader.close()
+        self.recorder.close()
+
+    def test_smaller_than_json(self):
+        self.play(100)
+        self.recorder.close()
+        monitor_stream = sum(len(json.dumps(record))
+            for snapshot in self.snapshots.values()
+            for record in snapshot.values())
+        self.assertTrue(os.path.getsize(self.path) * 10 < monitor_stream)
+
+    def test_not_a_recording(self):
+        with open(self.path, 'wb') as out:
+            out.write('{"type": "header"}\n')
+        self.assertRaises(recording.RecordingError, recording.Recording,
+            self.path)
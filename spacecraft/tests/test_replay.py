@@ -0,0 +1,192 @@
+# -*- coding: utf-8 *-*
+import json
+import os
+import shutil
+import tempfile
+
+from twisted.trial.unittest import TestCase
+from twisted.internet import task
+from twisted.test.proto_helpers import StringTransport
+
+from spacecraft import recording, replay, world
+
+
+class TestReplay(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'match.rec')
+        game = world.Game(100, 100, start=True, seed=1)
+        self.player = world.PlayerObject(game, 50, 50)
+        self.player.name = 'first'
+        recorder = recording.Recorder(game, open(self.path, 'wb'),
+            chunk_ticks=20)
+        # tick -> position of the player then
+        self.positions = {}
+        for i in range(100):
+            self.player.throttle = 1
+            self.player.turn = 0.2
+            game.doStep()
+            self.positions[game.ticks] = json.loads(json.dumps(
+                game.get_snapshot()[self.player.get_id()]['position']))
+        recorder.close()
+        self.clock = task.Clock()
+        self.library = replay.Library(self.path)
+        self.library.clock = self.clock
+
+    def tearDown(self):
+        self.library.stopService()
+        shutil.rmtree(self.directory)
+
+    def connect(self, name=None):
+        monitor = replay.ReplayMonitor()
+        monitor.clock = self.clock
+        monitor.makeConnection(StringTransport())
+        monitor.register(self.library.get_arena(name))
+        return monitor
+
+    def read(self, monitor):
+        result = [json.loads(line)
+            for line in monitor.transport.value().splitlines()]
+        monitor.transport.clear()
+        return result
+
+    def position(self, messages):
+        for message in messages:
+            if message.get('object_type') == 'player':
+                return message['position']
+
+    def assertAt(self, tick, monitor):
+        self.clock.advance(monitor.map.timeStep)
+        self.assertEqual(tick, monitor.map.tick)
+        self.assertEqual(self.positions[tick], self.position(
+            self.read(monitor)))
+
+    def test_hello(self):
+        monitor = self.connect()
+        self.clock.advance(0)
+        hello, status = self.read(monitor)
+        self.assertEqual('map_description', hello['type'])
+        self.assertEqual(dict(type='replay', tick=1, first_tick=1,
+            last_tick=100, speed=1, frames=20), status)
+
+    def test_play(self):
+        monitor = self.connect()
+        self.clock.advance(0)
+        self.read(monitor)
+        for tick in range(2, 30):
+            self.assertAt(tick, monitor)
+        monitor.map.seek(1000)
+        self.read(monitor)
+        self.assertAt(100, monitor)
+        # it stays on the last tick
+        self.assertAt(100, monitor)
+
+    def test_seek_and_speed(self):
+        monitor = self.connect()
+        monitor.messageReceived(dict(type="seek", value=50))
+        self.assertEqual(50, self.read(monitor)[0]['tick'])
+        monitor.messageReceived(dict(type="speed", value=2.5))
+        self.read(monitor)
+        self.assertAt(52, monitor)
+        self.assertAt(55, monitor)
+        monitor.messageReceived(dict(type="skip", value=-1))
+        self.assertEqual(35, self.read(monitor)[0]['tick'])
+        monitor.messageReceived(dict(type="speed", value=-1))
+        self.read(monitor)
+        self.assertAt(34, monitor)
+        monitor.messageReceived(dict(type="start_game"))
+        self.read(monitor)
+        self.assertAt(34, monitor)
+        monitor.messageReceived(dict(type="start_game"))
+        self.read(monitor)
+        self.assertAt(33, monitor)
+        monitor.messageReceived(dict(type="speed", value="fast"))
+        self.assertEqual(-1, monitor.map.speed)
+
+    def test_seek_keyframe(self):
+        monitor = self.connect()
+        monitor.messageReceived(dict(type="monitor_mode", value="delta"))
+        kinds = []
+        for i in range(3):
+            self.clock.advance(monitor.map.timeStep)
+            kinds.append(self.read(monitor)[-2]['type'])
+        monitor.messageReceived(dict(type="seek", value=70))
+        self.clock.advance(monitor.map.timeStep)
+        kinds.append(self.read(monitor)[-2]['type'])
+        self.assertEqual(['monitor_keyframe', 'monitor_delta',
+            'monitor_delta', 'monitor_keyframe'], kinds)
+
+    def test_viewers_share_the_recording(self):
+        first = self.connect()
+        second = self.connect()
+        self.assertIsNot(first.map, second.map)
+        self.assertIs(first.map.recording, second.map.recording)
+        second.map.seek(80)
+        self.clock.advance(first.map.timeStep)
+        self.assertEqual((2, 81), (first.map.tick, second.map.tick))
+        # both chunks stay decoded
+        self.assertEqual([0, 4], sorted(first.map.recording.chunks))
+        first.connectionLost(None)
+        self.assertFalse(first.map.loop.running)
+        self.assertTrue(second.map.loop.running)
+        second.connectionLost(None)
+
+    def test_directory(self):
+        newer = os.path.join(self.directory, 'newer.rec')
+        shutil.copy(self.path, newer)
+        os.utime(newer, (os.path.getmtime(self.path) + 10,) * 2)
+        library = replay.Library(self.directory)
+        self.assertEqual('newer', library.default)
+        # the default is opened to see that it plays, not the others
+        self.assertEqual(['newer'], library.recordings.keys())
+        self.assertEqual(1, library.get_arena('match').tick)
+        self.assertEqual(['match', 'newer'], sorted(library.recordings))
+        self.assertIs(library.get_arena('nothing'), None)
+        library.stopService()
+
+    def test_still_recording(self):
+        path = os.path.join(self.directory, 'live.rec')
+        game = world.Game(100, 100, start=True, seed=1)
+        world.PlayerObject(game, 50, 50)
+        recorder = recording.Recorder(game, open(path, 'wb'), chunk_ticks=20)
+        for i in range(40):
+            game.doStep()
+        library = replay.Library(self.directory)
+        library.clock = self.clock
+        self.assertEqual('live', library.default)
+        playback = library.get_arena()
+        playback.seek(1000)
+        self.assertEqual(40, playback.tick)
+        for i in range(40):
+            game.doStep()
+        playback.seek(1000)
+        self.assertEqual(80, playback.tick)
+        self.assertEqual(80, library.get_arena().recording.last_tick)
+        recorder.close()
+        library.stopService()
+
+    def test_just_started(self):
+        os.utime(self.path, (os.path.getmtime(self.path) - 20,) * 2)
+        empty = os.path.join(self.directory, 'empty.rec')
+        open(empty, 'wb').close()
+        os.utime(empty, (os.path.getmtime(self.path) + 10,) * 2)
+        path = os.path.join(self.directory, 'live.rec')
+        game = world.Game(100, 100, start=True, seed=1)
+        world.PlayerObject(game, 50, 50)
+        recorder = recording.Recorder(game, open(path, 'wb'), chunk_ticks=20)
+        # the header is there before the first chunk
+        reader = recording.Recording(path)
+        self.assertEqual(100, reader.header['xsize'])
+        reader.close()
+        library = replay.Library(self.directory)
+        library.clock = self.clock
+        self.assertEqual('match', library.default)
+        self.assertEqual(100, library.get_arena().recording.last_tick)
+        self.assertIs(library.get_arena('live'), None)
+        for i in range(20):
+            game.doStep()
+        self.assertEqual(20, library.get_arena().recording.last_tick)
+        self.assertEqual('live', library.default)
+        recorder.close()
+        library.stopService()
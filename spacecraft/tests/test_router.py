@@ -0,0 +1,202 @@
+# -*- coding: utf-8 *-*
+import base64
+import json
+import os
+import socket
+
+from mock import Mock
+from twisted.internet import task
+from twisted.trial.unittest import TestCase
+from twisted.web.test.requesthelper import DummyRequest
+
+from spacecraft import arena, router, server, stats, world
+
+
+def make_worker(max_arenas=2, **clients):
+    worker = router.WorkerConnection()
+    worker.connectionMade()
+    worker.max_arenas = max_arenas
+    worker.arenas = [dict(name=name, clients=count)
+        for name, count in clients.items()]
+    worker.names = set(clients)
+    return worker
+
+
+class TestPlacement(TestCase):
+
+    def setUp(self):
+        self.router = router.Router(server.Options(), "unused")
+        self.busy = make_worker(red=5)
+        self.idle = make_worker(blue=1)
+        self.router.workers = [self.busy, self.idle]
+        self.router.placements = dict(red=self.busy, blue=self.idle)
+
+    def test_known_arena(self):
+        self.assertIs(self.router.place("red"), self.busy)
+
+    def test_least_loaded(self):
+        self.assertIs(self.router.place("green"), self.idle)
+        self.assertIs(self.router.placements["green"], self.idle)
+
+    def test_full(self):
+        self.idle.names.add("green")
+        self.assertIs(self.router.place("yellow"), self.busy)
+        self.busy.names.add("yellow")
+        self.assertIs(self.router.place("black"), None)
+
+    def test_forget(self):
+        self.busy.names = set()
+        self.router.forget(self.busy)
+        self.assertEqual(["blue"], self.router.placements.keys())
+
+    def test_worker_gone(self):
+        self.router.removeWorker(self.idle)
+        self.assertEqual([self.busy], self.router.workers)
+        self.assertEqual(["red"], self.router.placements.keys())
+
+
+class FakeTransport(object):
+    reading = True
+    disconnecting = False
+
+    def __init__(self):
+        self.fd = os.open(os.devnull, os.O_RDONLY)
+        self.written = ''
+        self.descriptors = []
+
+    def fileno(self):
+        return self.fd
+
+    def stopReading(self):
+        self.reading = False
+
+    def write(self, data):
+        self.written += data
+
+    def sendFileDescriptor(self, fd):
+        self.descriptors.append(fd)
+
+    def loseConnection(self):
+        self.disconnecting = True
+        # like tcp transports, shut the socket down before closing it
+        try:
+            socket.fromfd(self.fd, socket.AF_UNIX,
+                socket.SOCK_STREAM).shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        os.close(self.fd)
+
+
+class FakeWorker(object):
+
+    def __init__(self):
+        self.handed = []
+        self.descriptors = []
+
+    def handOff(self, fd, kind, name, data):
+        self.descriptors.append(fd)
+        self.handed.append((kind, name, data))
+
+
+class TestDoorman(TestCase):
+
+    def setUp(self):
+        self.router = router.Router(server.Options(), "unused")
+        self.router.clock = task.Clock()
+        self.worker = FakeWorker()
+        self.router.place = lambda name: self.worker
+        factory = router.DoormanFactory(self.router, "player")
+        self.doorman = factory.buildProtocol(None)
+        self.transport = FakeTransport()
+        self.doorman.makeConnection(self.transport)
+
+    def tearDown(self):
+        for fd in self.worker.descriptors:
+            os.close(fd)
+
+    def test_join(self):
+        self.doorman.dataReceived('{"type": "join_arena", "val')
+        self.assertEqual([], self.worker.handed)
+        self.doorman.dataReceived('ue": "red"}\r\n{"type": "name"')
+        self.assertEqual([("player", "red", '{"type": "name"')],
+            self.worker.handed)
+        self.assertFalse(self.transport.reading)
+        self.assertEqual([], self.router.clock.getDelayedCalls())
+
+    def test_connection_still_open(self):
+        client, ours = socket.socketpair()
+        os.close(self.transport.fd)
+        self.transport.fd = os.dup(ours.fileno())
+        ours.close()
+        self.doorman.dataReceived('{"type": "join_arena", "value": "red"}\r\n')
+        self.assertTrue(self.transport.disconnecting)
+        os.write(self.worker.descriptors[0], 'hello')
+        self.assertEqual('hello', client.recv(5))
+        client.close()
+
+    def test_other_message(self):
+        self.doorman.dataReceived('{"type": "name"}\r\n')
+        self.assertEqual([("player", "default", '{"type": "name"}\r\n')],
+            self.worker.handed)
+
+    def test_timeout(self):
+        self.router.clock.advance(self.router.join_timeout)
+        self.assertEqual([("player", "default", '')], self.worker.handed)
+
+    def test_no_room(self):
+        self.router.place = lambda name: None
+        self.doorman.dataReceived('{"type": "join_arena", "value": "red"}\r\n')
+        self.assertEqual("error", json.loads(self.transport.written)["type"])
+        self.assertTrue(self.transport.disconnecting)
+
+
+class TestWorkerConnection(TestCase):
+
+    def test_hand_off(self):
+        worker = make_worker()
+        worker.transport = FakeTransport()
+        worker.handOff(worker.transport.fd, "monitor", "red", "\x00binary")
+        self.assertEqual([worker.transport.fd],
+            worker.transport.descriptors)
+        message = json.loads(worker.transport.written)
+        self.assertEqual(("monitor", "red"),
+            (message["kind"], message["arena"]))
+        self.assertEqual("\x00binary", base64.b64decode(message["data"]))
+        self.assertEqual(1, worker.load())
+        self.assertTrue(worker.hasRoom())
+        worker.names.add("blue")
+        self.assertFalse(worker.hasRoom())
+        # the worker has it, so the router can let go of its copy
+        worker.lineReceived(json.dumps(dict(type="adopted",
+            id=message["id"])))
+        self.assertEqual(0, worker.load())
+
+
+class TestStats(TestCase):
+
+    def test_forwarded(self):
+        arenas = arena.ArenaManager(lambda: world.Game(100, 100),
+            max_arenas=2, keep_default=False)
+        red = arenas.get_arena("red")
+        red.stats = stats.TickStats(red.timeStep)
+        red.doStep()
+        arenas.get_arena("blue")
+        link = router.WorkerLink(arenas, {})
+        sent = []
+        link.sendLine = sent.append
+        link.sendLoad()
+
+        the_router = router.Router(server.Options(), "unused")
+        worker = make_worker()
+        worker.factory = Mock(router=the_router)
+        the_router.placements = dict(red=worker, blue=worker)
+        worker.lineReceived(sent[0])
+        self.assertEqual(1, the_router.stats("red")["ticks"])
+        self.assertIs(None, the_router.stats("blue"))
+
+        resource = router.RouterStatsResource(the_router)
+        request = DummyRequest(["red"])
+        self.assertEqual(1, json.loads(resource.render_GET(request))["ticks"])
+        request = DummyRequest(["blue"])
+        resource.render_GET(request)
+        self.assertEqual(404, request.responseCode)
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 *-*
+import json
+
 from mock import Mock
 from twisted.trial.unittest import TestCase
 from twisted.internet.endpoints import TCP4ClientEndpoint
 from twisted.internet.protocol import Factory, Protocol
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, task
+from twisted.test.proto_helpers import StringTransport
 
-from spacecraft import server, world
+from spacecraft import server, world, codec
 
 
 def update_collector(target):
@@ -74,17 +77,129 @@ class TestGame(TestCase):
         prepr = player.object.get_full_position()
         self.assertTrue("position" in prepr)
 
-    def test_monitor(self):
-        player = self.create_player()
+    def create_monitor(self):
         monitor = server.Monitor()
         monitor.register(self.map)
-        result = []
-        monitor.sendMessage = update_collector(result)
+        monitor.transport = StringTransport()
+        return monitor
+
+    def test_monitor(self):
+        player = self.create_player()
+        monitor = self.create_monitor()
         monitor.sendUpdate()
-        self.assertEquals(len(result), 2)
+        result = [json.loads(line)
+            for line in monitor.transport.value().splitlines()]
+        self.assertEquals(len(result), len(self.map.world.bodies) + 1)
+        self.assertEquals(result[-1], dict(type="time", step=self.map.step))
+        result = [r for r in result if r.get("object_type") == "player"]
+        self.assertEquals(len(result), 1)
         for p in ["angle", "velocity", "position"]:
             self.assertEquals(result[0][p],
-                player.object.get_full_position()[p])
+                json.loads(json.dumps(player.object.get_full_position()[p])))
+
+    def test_monitor_frame_shared(self):
+        self.create_player()
+        monitors = [self.create_monitor() for i in range(3)]
+        body = self.map.world.bodies[0]
+        body.userData.get_monitor_data = Mock(return_value={})
+        self.map.doStep()
+        self.assertEquals(body.userData.get_monitor_data.call_count, 1)
+        frames = set(m.transport.value() for m in monitors)
+        self.assertEquals(len(frames), 1)
+
+    def read_frame(self, monitor):
+        result = [json.loads(line)
+            for line in monitor.transport.value().splitlines()]
+        monitor.transport.clear()
+        return result
+
+    def test_monitor_delta(self):
+        monitor = self.create_monitor()
+        monitor.messageReceived(dict(type="monitor_mode", value="delta"))
+        self.map.doStep()
+        keyframe, time = self.read_frame(monitor)
+        self.assertEquals(keyframe["type"], "monitor_keyframe")
+        self.assertEquals(len(keyframe["objects"]),
+            len(self.map.world.bodies))
+        self.assertEquals(time["type"], "time")
+
+        self.map.doStep()
+        delta, time = self.read_frame(monitor)
+        self.assertEquals(delta, dict(type="monitor_delta", created=[],
+            changed=[], destroyed=[]))
+
+        powerup = self.map.world.bodies[0].userData
+        powerup.destroy()
+        new_powerup = world.PowerUp(self.map, 10, 10)
+        self.map.doStep()
+        delta, time = self.read_frame(monitor)
+        self.assertEquals(delta["destroyed"], [powerup.get_id()])
+        self.assertEquals([r["id"] for r in delta["created"]],
+            [new_powerup.get_id()])
+
+    def test_monitor_delta_keyframes(self):
+        monitor = self.create_monitor()
+        monitor.messageReceived(dict(type="monitor_mode", value="delta"))
+        kinds = []
+        for i in range(monitor.keyframe_interval * 2):
+            self.map.doStep()
+            kinds.append(self.read_frame(monitor)[0]["type"])
+        self.assertEquals(kinds.count("monitor_keyframe"), 3)
+
+    def test_update_rate(self):
+        # 20 ticks per second, 5 updates
+        monitor = self.create_monitor()
+        monitor.messageReceived(dict(type="update_rate", value=5))
+        frames = []
+        for i in range(12):
+            self.map.doStep()
+            frames.append(bool(monitor.transport.value()))
+            monitor.transport.clear()
+        self.assertEquals(frames.count(True), 3)
+        # events don't wait
+        self.map.notifyEvent(type="boom")
+        self.assertTrue(monitor.transport.value())
+
+    def test_update_rate_keyframes(self):
+        monitor = self.create_monitor()
+        monitor.messageReceived(dict(type="monitor_mode", value="delta"))
+        monitor.messageReceived(dict(type="update_rate", value=20 / 3.))
+        kinds = []
+        for i in range(monitor.keyframe_interval * 3):
+            self.map.doStep()
+            if monitor.transport.value():
+                kinds.append(self.read_frame(monitor)[0]["type"])
+        # on ticks 1, 4, ... 58: the first one, and those after ticks 20
+        # and 40
+        self.assertEquals(len(kinds), 20)
+        self.assertEquals(kinds.count("monitor_keyframe"), 3)
+
+    def test_update_rate_and_send_every(self):
+        # 10 updates per second, but the game only sends every 3 ticks
+        monitor = self.create_monitor()
+        monitor.messageReceived(dict(type="update_rate", value=10))
+        self.map.send_every = 3
+        frames = []
+        for i in range(12):
+            self.map.doStep()
+            frames.append(bool(monitor.transport.value()))
+            monitor.transport.clear()
+        self.assertEquals([1, 4, 7, 10],
+            [i + 1 for i, sent in enumerate(frames) if sent])
+        # and the other way around
+        monitor.messageReceived(dict(type="update_rate", value=5))
+        self.map.send_every = 2
+        frames = []
+        for i in range(12):
+            self.map.doStep()
+            frames.append(bool(monitor.transport.value()))
+            monitor.transport.clear()
+        self.assertEquals(3, frames.count(True))
+
+    def test_bad_update_rate(self):
+        monitor = self.create_monitor()
+        monitor.messageReceived(dict(type="update_rate", value="fast"))
+        self.assertIdentical(monitor.update_rate, None)
 
     def test_throttle(self):
         player = self.create_player()
@@ -131,3 +246,215 @@ class TestGame(TestCase):
         self.assertEquals(len(result), 1)
         self.assertEquals(result[0]["position"],
             tuple(player2.object.body.position))
+
+
+class TestBackpressure(TestCase):
+
+    def setUp(self):
+        self.map = world.Game(100, 100)
+        self.monitor = server.Monitor()
+        self.monitor.clock = task.Clock()
+        self.monitor.map = self.map
+        self.map.register_client(self.monitor)
+        self.transport = StringTransport()
+        self.monitor.makeConnection(self.transport)
+
+    def test_registered(self):
+        self.assertIs(self.transport.producer, self.monitor)
+        self.assertTrue(self.transport.streaming)
+
+    def test_skip_while_paused(self):
+        self.monitor.pauseProducing()
+        self.map.doStep()
+        self.map.doStep()
+        self.assertEqual('', self.transport.value())
+        self.monitor.resumeProducing()
+        self.map.doStep()
+        messages = self.transport.value().splitlines()
+        self.assertEqual(dict(type="time", step=self.map.step),
+            json.loads(messages[-1]))
+        self.assertEqual(len(self.map.world.bodies) + 1, len(messages))
+
+    def test_events_still_sent(self):
+        self.monitor.pauseProducing()
+        self.map.start_game()
+        self.assertEqual("game_status",
+            json.loads(self.transport.value())["type"])
+
+    def test_too_much_backlog(self):
+        self.monitor.max_backlog = 100
+        self.monitor.pauseProducing()
+        for i in range(10):
+            self.map.notifyEvent(type="spam", value=i)
+        self.assertTrue(self.transport.disconnected)
+        self.assertTrue(len(self.transport.value()) <= 100)
+
+    def test_stalled(self):
+        self.monitor.pauseProducing()
+        self.monitor.clock.advance(self.monitor.stall_timeout - 1)
+        self.map.doStep()
+        self.assertFalse(self.transport.disconnected)
+        self.monitor.clock.advance(2)
+        self.map.doStep()
+        self.assertTrue(self.transport.disconnected)
+
+
+class MessageCollector(server.ClientBase):
+    def __init__(self):
+        self.received = []
+
+    def messageReceived(self, message):
+        self.received.append(message)
+
+
+class TestWireProtocol(TestCase):
+    if "binary" not in codec.codecs:
+        skip = "msgpack is not installed"
+
+    def setUp(self):
+        self.map = world.Game(100, 100)
+        self.binary = codec.codecs["binary"]
+
+    def test_mixed_frames(self):
+        client = MessageCollector()
+        client.makeConnection(StringTransport())
+        data = (json.dumps(dict(type="a")) + "\r\n" +
+            self.binary.frame(self.binary.encode(dict(type="b", x=1.5))) +
+            json.dumps(dict(type="c")) + "\r\n")
+        # in small pieces, to make sure frames get reassembled
+        for i in range(0, len(data), 3):
+            client.dataReceived(data[i:i + 3])
+        self.assertEquals([dict(type="a"), dict(type="b", x=1.5),
+            dict(type="c")], client.received)
+
+    def test_frame_too_long(self):
+        player = server.Player()
+        player.makeConnection(StringTransport())
+        header = codec.BinaryCodec.header
+        player.dataReceived(header.pack(player.MAX_LENGTH + 1) + "\x80")
+        self.assertTrue(player.transport.disconnecting)
+        self.assertEquals('', player._buffer)
+        self.assertIdentical(None, player._frame)
+
+    def test_big_frame_in_pieces(self):
+        client = MessageCollector()
+        client.makeConnection(StringTransport())
+        message = dict(type="big", value="x" * 100000)
+        data = (self.binary.frame(self.binary.encode(message)) +
+            json.dumps(dict(type="after")) + "\r\n")
+        for i in range(0, len(data), 1000):
+            client.dataReceived(data[i:i + 1000])
+        self.assertEquals([message, dict(type="after")], client.received)
+
+    def test_not_messages(self):
+        client = MessageCollector()
+        client.makeConnection(StringTransport())
+        for line in ('[1, 2]', '{"type": "batch"}',
+                '{"type": "batch", "messages": [3, {"type": "ok"}]}'):
+            client.dataReceived(line + "\r\n")
+        self.assertEquals([dict(type="ok")], client.received)
+
+    def test_negotiation(self):
+        client = MessageCollector()
+        client.preferred_codec = "binary"
+        client.makeConnection(StringTransport())
+
+        player = server.Player()
+        player.makeConnection(StringTransport())
+        player.register(self.map)
+        reactor.iterate()
+        player.transport.clear()
+
+        player.dataReceived(client.transport.value())
+        reply = player.transport.value()
+        self.assertEquals(json.loads(reply),
+            {"type": "protocol accepted", "value": "binary"})
+        client.dataReceived(reply)
+        self.assertEquals(client.codec, self.binary)
+        self.assertEquals(player.codec, self.binary)
+
+        client.transport.clear()
+        client.command("throttle", value=0.5)
+        self.assertEquals("\x00", client.transport.value()[0])
+        player.dataReceived(client.transport.value())
+        self.assertEquals(player.object.throttle, 0.5)
+
+    def test_unsupported_protocol(self):
+        player = server.Player()
+        player.makeConnection(StringTransport())
+        player.messageReceived(dict(type="protocol", value="smoke signals"))
+        self.assertEquals(json.loads(player.transport.value()),
+            {"type": "protocol accepted", "value": "json"})
+        self.assertEquals(player.codec, codec.JSON)
+
+    def test_binary_monitor(self):
+        monitor = server.Monitor()
+        monitor.register(self.map)
+        monitor.makeConnection(StringTransport())
+        monitor.codec = self.binary
+        self.map.doStep()
+        client = MessageCollector()
+        client.makeConnection(StringTransport())
+        client.dataReceived(monitor.transport.value())
+        self.assertEquals(["monitor"] * len(self.map.world.bodies) + ["time"],
+            [m["type"] for m in client.received])
+
+
+
+class CountingTransport(StringTransport):
+    writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        StringTransport.write(self, data)
+
+
+class TestBatches(TestCase):
+
+    def setUp(self):
+        self.map = world.Game(100, 100, start=True)
+        world.PlayerObject(self.map)
+
+    def connect(self, client):
+        client.makeConnection(StringTransport())
+        monitor = server.Monitor()
+        monitor.map = self.map
+        self.map.register_client(monitor)
+        monitor.makeConnection(CountingTransport())
+        monitor.dataReceived(client.transport.value())
+        return client, monitor
+
+    def test_one_write_per_tick(self):
+        client, monitor = self.connect(MessageCollector())
+        self.assertTrue(monitor.batched)
+        self.map.notifyEvent(type="outside a tick")
+        self.assertEquals(1, monitor.transport.writes)
+        monitor.transport.clear()
+
+        # an event during the tick goes out in the same write
+        player = self.map.players[0]
+        player.execute = player.destroy
+        self.map.doStep()
+        self.assertEquals(2, monitor.transport.writes)
+        event, batch = [json.loads(line)
+            for line in monitor.transport.value().splitlines()]
+        self.assertEquals("player_died", event["type"])
+        self.assertEquals("batch", batch["type"])
+        self.assertEquals(len(self.map.world.bodies) + 1,
+            len(batch["messages"]))
+
+        client.dataReceived(monitor.transport.value())
+        types = [message["type"] for message in client.received]
+        self.assertEquals("player_died", types[0])
+        self.assertEquals(["monitor"] * len(self.map.world.bodies) + ["time"],
+            types[1:])
+
+    def test_without_batches(self):
+        client = MessageCollector()
+        client.accept_batches = False
+        client, monitor = self.connect(client)
+        self.assertFalse(monitor.batched)
+        self.map.doStep()
+        lines = monitor.transport.value().splitlines()
+        self.assertEquals(len(self.map.world.bodies) + 1, len(lines))
+        self.assertEquals(1, monitor.transport.writes)
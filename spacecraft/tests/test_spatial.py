@@ -0,0 +1,105 @@
+# -*- coding: utf-8 *-*
+from unittest import TestCase
+
+import Box2D
+import numpy
+
+from spacecraft import spatial
+
+
+class TestProximityGrid(TestCase):
+
+    def make_grid(self, points, size=100, cell_size=30):
+        positions = numpy.array(points, dtype=float).reshape(-1, 2)
+        return spatial.ProximityGrid(range(len(points)), positions,
+            size, size, cell_size)
+
+    def test_query(self):
+        grid = self.make_grid([(50, 50), (60, 60), (85, 50), (10, 10)])
+        self.assertEqual([0, 1], grid.query((50, 50), 30))
+
+    def test_query_empty(self):
+        grid = self.make_grid([])
+        self.assertEqual([], grid.query((50, 50), 30))
+
+    def test_query_wraps_around(self):
+        grid = self.make_grid([(98, 92), (2, 2), (50, 50)])
+        self.assertEqual([0, 1], grid.query((5, 95), 10))
+
+    def test_matches_brute_force(self):
+        random = numpy.random.RandomState(42)
+        points = random.uniform(0, 100, (200, 2))
+        grid = self.make_grid(points, cell_size=12)
+        for center in random.uniform(0, 100, (20, 2)):
+            delta = numpy.abs(points - center)
+            delta = numpy.minimum(delta, 100 - delta)
+            expected = numpy.nonzero((delta ** 2).sum(axis=1) < 15 ** 2)[0]
+            self.assertEqual(list(expected), grid.query(center, 15))
+
+
+class ClosestHit(Box2D.b2RayCastCallback):
+    def __init__(self):
+        Box2D.b2RayCastCallback.__init__(self)
+        self.fixture = None
+
+    def ReportFixture(self, fixture, point, normal, fraction):
+        self.fixture = fixture
+        return fraction
+
+
+class TestShapeIndex(TestCase):
+
+    def setUp(self):
+        self.world = Box2D.b2.world(gravity=(0, 0))
+        random = numpy.random.RandomState(7)
+        for i, (x, y) in enumerate(random.uniform(0, 100, (40, 2))):
+            body = self.world.CreateDynamicBody(position=(x, y), userData=i)
+            body.CreateCircleFixture(radius=random.uniform(1, 4))
+        for i, (x, y) in enumerate(random.uniform(0, 100, (5, 2))):
+            self.world.CreateStaticBody(position=(x, y), userData=100 + i,
+                shapes=Box2D.b2PolygonShape(box=(6, 2)))
+        self.shapes = spatial.ShapeIndex.from_bodies(self.world.bodies)
+
+    def box2d_cast(self, origin, directions, length):
+        result = []
+        for dx, dy in directions:
+            callback = ClosestHit()
+            self.world.RayCast(callback, origin,
+                (origin[0] + dx * length, origin[1] + dy * length))
+            if callback.fixture is not None:
+                result.append(callback.fixture.body.userData)
+        return result
+
+    def test_matches_box2d(self):
+        directions = spatial.ray_directions(90)
+        for origin in [(50, 50), (10, 90), (75, 20)]:
+            expected = self.box2d_cast(origin, directions, 30)
+            result = self.shapes.cast(origin, directions, 30)
+            self.assertEqual(sorted(set(expected)), sorted(result))
+
+    def test_parallel_ray_misses_box_beside_it(self):
+        world = Box2D.b2.world(gravity=(0, 0))
+        world.CreateStaticBody(position=(20, 30), userData='wall',
+            shapes=Box2D.b2PolygonShape(box=(10, 1)))
+        shapes = spatial.ShapeIndex.from_bodies(world.bodies)
+        # along x and y, level with the wall but away from it
+        for direction in ((1, 0), (0, 1)):
+            directions = numpy.array([direction], dtype=float)
+            self.assertEqual([], shapes.cast((0, 0), directions, 50))
+        # and still hitting it when in line with it
+        directions = numpy.array([(1, 0)], dtype=float)
+        self.assertEqual(['wall'], shapes.cast((0, 30), directions, 50))
+
+    def test_ignores_shape_containing_origin(self):
+        body = self.world.bodies[0]
+        origin = tuple(body.position)
+        result = self.shapes.cast(origin, spatial.ray_directions(8), 0.1)
+        self.assertFalse(body.userData in result)
+
+    def test_object_once(self):
+        body = self.world.CreateDynamicBody(position=(50, 20), userData='two')
+        body.CreateCircleFixture(radius=1, pos=(-2, 0))
+        body.CreateCircleFixture(radius=1, pos=(2, 0))
+        shapes = spatial.ShapeIndex.from_bodies([body])
+        result = shapes.cast((50, 10), spatial.ray_directions(360), 20)
+        self.assertEqual(['two'], result)
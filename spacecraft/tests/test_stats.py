@@ -0,0 +1,88 @@
+# -*- coding: utf-8 *-*
+import json
+
+from mock import Mock
+from twisted.trial.unittest import TestCase
+from twisted.web.test.requesthelper import DummyRequest
+
+from spacecraft import budget, stats, world
+
+
+class TestHistogram(TestCase):
+
+    def test_add(self):
+        histogram = stats.Histogram()
+        for seconds in [0.00005, 0.003, 0.004, 5]:
+            histogram.add(seconds)
+        summary = histogram.summary()
+        self.assertEqual(4, summary['count'])
+        self.assertEqual(5000, summary['max'])
+        buckets = dict((bound, count) for bound, count in summary['buckets'])
+        self.assertEqual(1, buckets[0.1])
+        self.assertEqual(2, buckets[5])
+        self.assertEqual(1, buckets[None])
+
+
+class TestTickStats(TestCase):
+
+    def setUp(self):
+        self.game = world.Game(100, 100, start=True)
+        self.game.stats = stats.TickStats(self.game.timeStep)
+        client = Mock()
+        client.sendUpdate = lambda: self.game.timed('sensors', lambda: None)
+        self.game.register_client(client)
+
+    def test_phases(self):
+        for i in range(3):
+            self.game.doStep()
+        summary = self.game.stats.summary()
+        self.assertEqual(3, summary['ticks'])
+        self.assertEqual(3, summary['tick']['count'])
+        self.assertEqual(1, summary['clients'])
+        self.assertEqual(len(self.game.world.bodies), summary['bodies'])
+        for phase in stats.TickStats.phases:
+            self.assertEqual(3, summary['phases'][phase]['count'])
+
+    def test_waiting_game_only_sends(self):
+        self.game.status = world.STATUS_WAITING
+        self.game.doStep()
+        phases = self.game.stats.summary()['phases']
+        self.assertEqual(0, phases['physics']['count'])
+        self.assertEqual(1, phases['send']['count'])
+
+    def test_overruns(self):
+        self.game.stats.time_step = 0
+        self.game.doStep()
+        self.assertEqual(1, self.game.stats.summary()['overruns'])
+
+    def test_resource(self):
+        self.game.doStep()
+        request = DummyRequest([''])
+        body = stats.StatsResource(self.game).render_GET(request)
+        self.assertEqual(1, json.loads(body)['ticks'])
+
+    def test_resource_budget(self):
+        self.game.budget = budget.TickBudget(self.game.timeStep)
+        self.game.budget.change(self.game, 1, 1.0)
+        request = DummyRequest([''])
+        body = stats.StatsResource(self.game).render_GET(request)
+        summary = json.loads(body)['budget']
+        self.assertEqual(1, summary['level'])
+        self.assertEqual((5, 5, 1), (summary['vel_iters'],
+            summary['pos_iters'], summary['send_every']))
+
+    def test_arenas(self):
+        arenas = Mock(default="default",
+            arenas=dict(default=self.game, red=world.Game(100, 100)))
+        arenas.arenas["red"].stats = stats.TickStats(self.game.timeStep)
+        arenas.arenas["red"].doStep()
+        arenas.arenas["red"].doStep()
+        self.game.doStep()
+        root = stats.ArenaStatsResource(arenas)
+        for name, ticks in (("", 1), ("default", 1), ("red", 2)):
+            request = DummyRequest([name])
+            body = root.getChild(name, request).render(request)
+            self.assertEqual(ticks, json.loads(body)['ticks'])
+        request = DummyRequest(["blue"])
+        root.getChild("blue", request).render(request)
+        self.assertEqual(404, request.responseCode)
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 *-*
+import os
+from unittest import TestCase
+
+from spacecraft import tournament
+
+BOTS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'test_headless.py')
+
+
+class TestTournament(TestCase):
+
+    def test_schedule(self):
+        self.assertEqual([('a', 'b'), ('a', 'c'), ('b', 'c')] * 2,
+            tournament.schedule(['a', 'b', 'c'], rounds=2))
+
+    def test_play_match(self):
+        bots = (BOTS + ':Duck', BOTS + ':Quitter')
+        result = tournament.play_match((bots, dict(max_steps=20)))
+        self.assertEqual(list(bots), result['bots'])
+        self.assertEqual([True, False],
+            [player['won'] for player in result['players']])
+        self.assertEqual(['duck', 'quitter'],
+            [player['name'] for player in result['players']])
+
+    def test_standings(self):
+        def player(bot, won, frags):
+            return dict(bot=bot, won=won, frags=frags, hits=frags)
+        matches = [
+            dict(players=[player('a', False, 0), player('b', True, 1)]),
+            dict(players=[player('a', True, 2), player('c', False, 0)]),
+            dict(players=[player('b', True, 1), player('c', False, 3)]),
+            ]
+        table = tournament.standings(matches)
+        self.assertEqual(['b', 'a', 'c'], [row['bot'] for row in table])
+        self.assertEqual(dict(bot='b', matches=2, wins=2, frags=2, hits=2),
+            table[0])
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 *-*
+import math
+
+from twisted.trial import unittest
+
+from spacecraft import euclid, vectors
+
+
+class TestVectors(unittest.TestCase):
+
+    def test_polar(self):
+        for angle in (0, 0.5, 2, math.pi, 5):
+            expected = euclid.Matrix3.new_rotate(angle) * \
+                euclid.Vector2(3, 0)
+            x, y = vectors.polar(3, angle)
+            self.assertAlmostEqual(x, expected.x)
+            self.assertAlmostEqual(y, expected.y)
+
+    def test_distance(self):
+        self.assertEqual(vectors.distance((1, 1), (4, 5)), 5)
+        self.assertAlmostEqual(vectors.distance((0, 0), (-1, 1)),
+            abs(euclid.Point2(0, 0) - euclid.Point2(-1, 1)))
+
+    def test_heading(self):
+        heading = vectors.Heading()
+        self.assertEqual(heading.update(0), (1, 0))
+        x, y = heading.forward(-2)
+        self.assertEqual((x, y), (-2, 0))
+        cos, sin = heading.update(math.pi / 2)
+        self.assertAlmostEqual(cos, 0)
+        self.assertAlmostEqual(sin, 1)
+        x, y = heading.forward(135)
+        self.assertAlmostEqual(x, 0)
+        self.assertAlmostEqual(y, 135)
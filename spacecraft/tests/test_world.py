@@ -2,6 +2,7 @@
 from unittest import TestCase
 
 from spacecraft import world
+from spacecraft import map as map_module
 
 
 class TestCollision(TestCase):
@@ -17,6 +18,23 @@ class TestCollision(TestCase):
         self.assertEquals(result1, [o2])
         self.assertFalse(o2.body in map.world.bodies)
 
+    def test_contact_once(self):
+        map = world.Game(1024, 768)
+        player = world.PlayerObject(map, 100, 100)
+        mine = world.ProximityMine(map, 100, 100)
+        result = []
+        mine.contact = result.append
+        for i in range(5):
+            map.step_world()
+        self.assertEquals(result, [player])
+
+    def test_contact_not_reacting(self):
+        map = world.Game(1024, 768)
+        world.PlayerObject(map, 100, 100)
+        world.PlayerObject(map, 101, 100)
+        map.world.Step(map.timeStep, map.vel_iters, map.pos_iters)
+        self.assertEquals(map.contact_listener.collect(), [])
+
 
 class TestWorld(TestCase):
 
@@ -29,7 +47,7 @@ class TestWorld(TestCase):
         result = []
         mock = Mock()
         mock.sendMessage = lambda **kwargs: result.append(kwargs)
-        map.clients.append(mock)
+        map.register_client(mock)
         map.start_game()
         self.assertEquals(len(result), 1)
         self.assertEquals(result[0],
@@ -46,6 +64,150 @@ class TestWorld(TestCase):
         map.step_world()
         self.assertEquals(o1.body.position[0], 100)
 
+    def test_wraparound_not_cached(self):
+        map = world.Game(1024, 768)
+        o1 = world.PowerUp(map, 1024 + 100, 100)
+        world.PlayerObject(map, 1024 + 100, 100)
+        # somebody looks at the world while handling contacts
+        o1.contact = lambda other: map.get_snapshot()
+        map.step_world()
+        self.assertEquals(map.get_snapshot()[o1.get_id()]['position'][0],
+            100)
+
+    def test_wraparound_moving(self):
+        map = world.Game(100, 100)
+        # nothing to run into
+        for body in list(map.world.bodies):
+            body.userData.destroy()
+        o1 = world.PowerUp(map, 50, 50)
+        o1.body.linearVelocity = 30, 0
+        xs = []
+        for i in range(100):
+            map.step_world()
+            xs.append(o1.body.position[0])
+        self.assertTrue(all(0 <= x < 100 for x in xs))
+        self.assertTrue(any(later < earlier
+            for earlier, later in zip(xs, xs[1:])))
+
+    def test_wraparound_schedule(self):
+        map = world.Game(1000, 1000)
+        o1 = world.PowerUp(map, 500, 500)
+        o2 = world.PowerUp(map, 1, 500)
+        map.step_world()
+        # halfway through the map, it can't be out for a while
+        self.assertEqual(map.wraparound.next_step[o1], 1 + 250)
+        self.assertEqual(map.wraparound.next_step[o2], 2)
+        o2.destroy()
+        map.step_world()
+        self.assertFalse(o2 in map.wraparound.next_step)
+
+    def test_wraparound_reused_bullet(self):
+        map = world.Game(100, 100)
+        bullet = map.projectiles.spawn(world.Bullet, 50, 50, 0, 0)
+        bullet.destroy()
+        map.projectiles.execute()
+        again = map.projectiles.spawn(world.Bullet, 150, 50, 0, 0)
+        self.assertIs(again, bullet)
+        map.step_world()
+        self.assertEqual(bullet.body.position[0], 50)
+
+
+class TestRegistry(TestCase):
+
+    def test_order_and_removal(self):
+        registry = world.Registry()
+        objects = [object() for i in range(5)]
+        for obj in objects:
+            registry.add(obj)
+        self.assertTrue(registry.discard(objects[1]))
+        self.assertFalse(registry.discard(objects[1]))
+        self.assertEqual(list(registry), objects[:1] + objects[2:])
+        self.assertEqual(len(registry), 4)
+        self.assertEqual(registry[0], objects[0])
+        self.assertTrue(objects[2] in registry)
+        self.assertFalse(objects[1] in registry)
+
+    def test_change_while_iterating(self):
+        registry = world.Registry()
+        objects = [object() for i in range(5)]
+        for obj in objects:
+            registry.add(obj)
+        seen = []
+        for obj in registry:
+            seen.append(obj)
+            registry.discard(obj)
+            registry.add(object())
+        self.assertEqual(seen, objects)
+        self.assertEqual(len(registry), 5)
+        self.assertFalse(any(obj in registry for obj in objects))
+
+
+
+class TestProjectiles(TestCase):
+
+    def fire(self, map, count):
+        return [map.projectiles.spawn(world.Bullet, i * 3, 50, 0, 0)
+            for i in range(count)]
+
+    def test_expire(self):
+        map = world.Game(300, 100, start=True)
+        bullets = self.fire(map, 80)
+        self.assertEqual(80, len(map.projectiles))
+        for i in range(world.Bullet.total_ttl):
+            map.doStep()
+        self.assertEqual(0, len(map.projectiles))
+        self.assertFalse(any(bullet.body.active for bullet in bullets))
+        self.assertFalse(any(bullet.body in map.get_bodies()
+            for bullet in bullets))
+
+    def test_reuse(self):
+        map = world.Game(300, 100, start=True)
+        first = self.fire(map, 10)
+        ids = set(bullet.get_id() for bullet in first)
+        bodies = len(map.world.bodies)
+        for bullet in first:
+            bullet.destroy()
+        # not before the next tick
+        self.assertEqual(20, len(set(first + self.fire(map, 10))))
+        map.doStep()
+        again = self.fire(map, 20)
+        self.assertEqual(bodies + 20, len(map.world.bodies))
+        self.assertTrue(set(first) <= set(again))
+        self.assertFalse(ids & set(bullet.get_id() for bullet in again))
+
+    def test_shooter(self):
+        map = world.Game(100, 100)
+        player = world.PlayerObject(map, 10, 10)
+        bullet = map.projectiles.spawn(world.Bullet, 20, 20, 0, 0,
+            shooter=player)
+        self.assertIs(bullet.shooter, player)
+        bullet.destroy()
+        self.assertIs(bullet.shooter, None)
+
+
+class TestFullPosition(TestCase):
+
+    def test_read_once_per_tick(self):
+        map = world.Game(100, 100)
+        watcher = world.PlayerObject(map, 10, 10)
+        player = world.PlayerObject(map, 15, 10)
+        player.body.linearVelocity = (10, 0)
+        reads = []
+        read_position = player.read_position
+        player.read_position = lambda: reads.append(1) or read_position()
+
+        for i in range(3):
+            watcher.getReadings()
+            readings = player.getReadings()
+        self.assertEqual(1, len(reads))
+        self.assertEqual(readings['gps']['position'], (15, 10))
+        readings['gps']['position'] = None
+        self.assertEqual(player.get_full_position()['position'], (15, 10))
+
+        map.step_world()
+        self.assertNotEqual(player.getReadings()['gps']['position'], (15, 10))
+        self.assertEqual(2, len(reads))
+
 
 class TestPowerUp(TestCase):
     def test_increase_force(self):
@@ -64,10 +226,33 @@ class TestProximityMine(TestCase):
         mine = world.ProximityMine(map, 100, 100)
         world.PlayerObject(map, 100, 100)
         map.step_world()
-        self.assertEqual(mine.bullets + 1, len(map.objects))
-        shrapnel = [x for x in map.objects if isinstance(x, world.Shrapnel)]
+        self.assertEqual(mine.bullets, len(map.projectiles))
+        shrapnel = [x for x in map.projectiles
+            if isinstance(x, world.Shrapnel)]
         self.assertEqual(mine.bullets, len(shrapnel))
 
+    def test_shrapnel_goes_through_shrapnel(self):
+        map = world.Game(1024, 768)
+        for i in range(20):
+            map.projectiles.spawn(world.Shrapnel, 100, 100, 0, 0)
+        bullet = map.projectiles.spawn(world.Bullet, 100, 100, 0, 0)
+        map.world.Step(map.timeStep, map.vel_iters, map.pos_iters)
+        pairs = set(frozenset((contact.fixtureA.body.userData,
+                contact.fixtureB.body.userData))
+            for contact in map.world.contacts)
+        self.assertEqual(20, len(pairs))
+        self.assertTrue(all(bullet in pair for pair in pairs))
+
+
+class TestCategories(TestCase):
+
+    def test_default(self):
+        class Thing(world.ObjectBase):
+            pass
+        # only walls are walls
+        self.assertEqual(world.CATEGORY_ALL, Thing.category)
+        self.assertEqual(world.CATEGORY_WALL, map_module.Wall.category)
+
 
 class TestProximitySensor(TestCase):
 
@@ -76,5 +261,13 @@ class TestProximitySensor(TestCase):
         pu = world.EngineForcePowerUp(map, 60, 60)
         pl = world.PlayerObject(map, 50, 50)
         sensor = world.ProximitySensor(pl)
-        result = list(sensor.getReadings())
+        result = [r for r in sensor.getReadings() if r["id"] == pu.get_id()]
         self.assertEquals(pu.body.position, result[0]["position"])
+
+    def test_report_across_edges(self):
+        map = world.Game(100, 100)
+        pu = world.EngineForcePowerUp(map, 95, 95)
+        pl = world.PlayerObject(map, 5, 5)
+        sensor = world.ProximitySensor(pl)
+        result = [r for r in sensor.getReadings() if r["id"] == pu.get_id()]
+        self.assertEquals(1, len(result))
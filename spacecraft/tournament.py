@@ -0,0 +1,112 @@
+# -*- coding: utf-8 *-*
+"""Rank bots by playing many headless matches on a pool of processes.
+
+Every pair of bots plays each other a number of rounds, one match per
+worker, e.g.:
+
+    python -m spacecraft.tournament -j 32 -r 4 -o standings.json bots/*.py
+"""
+import itertools
+import json
+import multiprocessing
+from optparse import OptionParser
+
+from spacecraft import headless
+
+
+def schedule(bots, rounds=1, size=2):
+    """Every combination of size different bots, rounds times."""
+    return [combination for i in range(rounds)
+        for combination in itertools.combinations(bots, size)]
+
+
+def play_match(match_spec):
+    """Plays one match and returns what happened to each bot.
+
+    match_spec is a (bots, options) tuple, where bots are specs for
+    headless.load_bot and options are the keyword arguments for
+    headless.Match plus max_steps.
+    """
+    specs, options = match_spec
+    options = dict(options)
+    max_steps = options.pop('max_steps', None)
+    match = headless.Match([headless.load_bot(spec)() for spec in specs],
+        **options)
+    match.run(max_steps)
+    game = match.game
+    winner = game.winner.name if game.winner is not None else None
+    players = []
+    for spec, player in zip(specs, match.players):
+        ship = player.object
+        players.append(dict(bot=spec, name=ship.name, frags=ship.frags,
+            hits=ship.hits, won=ship.name == winner))
+    return dict(bots=list(specs), players=players, steps=game.step,
+        result_table=game.get_result_table())
+
+
+def standings(matches):
+    """Adds up the results of matches per bot, best bot first."""
+    table = {}
+    for match in matches:
+        for player in match['players']:
+            row = table.setdefault(player['bot'], dict(bot=player['bot'],
+                matches=0, wins=0, frags=0, hits=0))
+            row['matches'] += 1
+            row['wins'] += player['won']
+            row['frags'] += player['frags']
+            row['hits'] += player['hits']
+    return sorted(table.values(), reverse=True,
+        key=lambda row: (row['wins'], row['frags'], row['hits']))
+
+
+def run(bots, rounds=1, processes=None, **options):
+    """Plays every pair of bots against each other in parallel.
+
+    Returns the standings and the result of every match.
+    """
+    specs = [(pair, options) for pair in schedule(bots, rounds)]
+    pool = multiprocessing.Pool(processes)
+    try:
+        # one match at a time per worker, they are long enough
+        matches = list(pool.imap_unordered(play_match, specs, chunksize=1))
+    finally:
+        pool.terminate()
+    return standings(matches), matches
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] bot.py[:Class] ...")
+    parser.add_option("-j", "--processes", type="int", default=None,
+                      help="How many matches to play at once, one per CPU "
+                      "by default.")
+    parser.add_option("-r", "--rounds", type="int", default=1,
+                      help="How many times each pair of bots plays.")
+    parser.add_option("-x", "--xsize", type="int", default=100,
+                      help="The map x size.")
+    parser.add_option("-y", "--ysize", type="int", default=100,
+                      help="The map y size.")
+    parser.add_option("-m", "--map", default=None,
+                      help="Play on this map.")
+    parser.add_option("-s", "--steps", type="int", default=10000,
+                      help="Stop each match after this many steps.")
+    parser.add_option("-o", "--output", default=None,
+                      help="Write the standings and matches to this file, "
+                      "as json.")
+    (options, args) = parser.parse_args()
+    if len(args) < 2:
+        parser.error("need at least two bots")
+    table, matches = run(args, options.rounds, options.processes,
+        xsize=options.xsize, ysize=options.ysize, map_file=options.map,
+        max_steps=options.steps)
+    for position, row in enumerate(table):
+        print '%2i. %s: %i wins in %i matches, %i frags, %i hits' % (
+            position + 1, row['bot'], row['wins'], row['matches'],
+            row['frags'], row['hits'])
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(dict(standings=table, matches=matches), output,
+                indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 *-*
+"""2D math on plain floats, for the code that runs every tick.
+
+euclid reads nicer, but allocates a matrix and a vector or two for every
+operation, which adds up with many ships.
+"""
+import math
+
+
+def polar(length, angle):
+    """The x and y of a vector length long pointing at angle."""
+    return length * math.cos(angle), length * math.sin(angle)
+
+
+def distance(p1, p2):
+    return math.hypot(p1[0] - p2[0], p1[1] - p2[1])
+
+
+class Heading(object):
+    """The cosine and sine of an angle, computed again only if it changes."""
+    __slots__ = ('angle', 'cos', 'sin')
+
+    def __init__(self):
+        self.angle = None
+        self.cos = self.sin = 0.0
+
+    def update(self, angle):
+        if angle != self.angle:
+            self.angle = angle
+            self.cos = math.cos(angle)
+            self.sin = math.sin(angle)
+        return self.cos, self.sin
+
+    def forward(self, length):
+        """A vector length long in the direction of the heading."""
+        return self.cos * length, self.sin * length
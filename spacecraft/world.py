@@ -1,20 +1,32 @@
 # -*- coding: utf-8 *-*
+import itertools
 import random
 import math
 import sys
+from collections import OrderedDict
+from timeit import default_timer
 
+import numpy
 from Box2D import b2
-import Box2D
 
 from twisted.application import service
 from twisted.internet import task
 
-from spacecraft import euclid
+from spacecraft import spatial, vectors
 
 STATUS_WAITING = "waiting"
 STATUS_RUNNING = "running"
 STATUS_FINISHED = "finished"
 
+# collision categories of the fixtures of each kind of object, see
+# ObjectBase.category and ObjectBase.mask
+CATEGORY_WALL = 0x0001
+CATEGORY_PLAYER = 0x0002
+CATEGORY_BULLET = 0x0004
+CATEGORY_SHRAPNEL = 0x0008
+CATEGORY_POWERUP = 0x0010
+CATEGORY_ALL = 0xffff
+
 
 def trace(func):
     def tracer(frame, event, arg):
@@ -46,35 +58,108 @@ def trace(func):
     return inner
 
 
+class Registry(object):
+    """A set of objects (by identity) kept in the order they were added.
+
+    Adding and removing take constant time. Iterating goes over what was
+    there when the iteration started, so objects can be added or removed
+    while looping over them.
+    """
+
+    def __init__(self):
+        # id(obj) -> obj, clients have no game id
+        self.items = OrderedDict()
+        self.snapshot = []
+
+    def add(self, obj):
+        self.items[id(obj)] = obj
+        self.snapshot = None
+
+    def discard(self, obj):
+        """Removes obj, returns whether it was there."""
+        if self.items.pop(id(obj), None) is None:
+            return False
+        self.snapshot = None
+        return True
+
+    def values(self):
+        if self.snapshot is None:
+            self.snapshot = self.items.values()
+        return self.snapshot
+
+    def __iter__(self):
+        return iter(self.values())
+
+    def __getitem__(self, index):
+        return self.values()[index]
+
+    def __contains__(self, obj):
+        return id(obj) in self.items
+
+    def __len__(self):
+        return len(self.items)
+
+
 class Game(service.Service):
+    # how many ticks worth of snapshots to keep around, see get_snapshot()
+    keep_snapshots = 20
 
-    def __init__(self, xsize, ysize, frames=20, start=False):
+    def __init__(self, xsize, ysize, frames=20, start=False, vel_iters=10,
+            pos_iters=10, seed=None):
         self.xsize = xsize
         self.ysize = ysize
         self.timeStep = 1. / frames
-        self.vel_iters = 10
-        self.pos_iters = 10
+        self.vel_iters = vel_iters
+        self.pos_iters = pos_iters
+        # clients get updates every send_every ticks at most (see
+        # server.Client.wantsUpdate), events go out always
+        self.send_every = 1
         self.step = 0
-
-        self.world = b2.world(gravity=(0, 0), doSleep=True)
-        self.clients = []
-        self.objects = []
-        self.players = []
+        # number of times doStep was called, running or not
+        self.ticks = 0
+        # everything random in the game comes from here, the same seed and
+        # the same inputs make the same game
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        self.contact_listener = ContactListener()
+        self.world = b2.world(gravity=(0, 0), doSleep=True,
+            contactListener=self.contact_listener)
+        self.clients = Registry()
+        self.objects = Registry()
+        self.players = Registry()
         self.players_results = []
         self.terrain = []
-        self.taken_names = []
+        self.taken_names = set()
+        self.ids = itertools.count(1)
+        self.projectiles = Projectiles(self)
+        self.wraparound = Wraparound(self)
+        # values computed at most once per tick, see cached()
+        self.tick_cache = {}
+        self.snapshots = {}
 
         if start:
             self.status = STATUS_RUNNING
         else:
             self.status = STATUS_WAITING
         self.winner = None
+        # a stats.TickStats, to find out where the time of each tick goes
+        self.stats = None
+        # a budget.TickBudget, to do less when ticks take too long
+        self.budget = None
+        # an inputlog.InputLog, to play the game again later
+        self.inputs = None
+        # a recording.Recorder, to keep what happened in the game
+        self.recorder = None
         self.update_loop = task.LoopingCall(self.doStep)
         HealthPowerUpRespawn(self)
         HealthPowerUpRespawn(self)
 
 
     def start_game(self):
+        self.record("start_game")
         self.status = STATUS_RUNNING
         self.notifyEvent(type="game_status", current=self.status)
 
@@ -90,44 +175,152 @@ class Game(service.Service):
     def stopService(self):
         self.update_loop.stop()
 
+    def close(self):
+        """Finishes the logs and recordings of the game."""
+        if self.inputs is not None:
+            self.inputs.close()
+        if self.recorder is not None:
+            self.recorder.close()
+
     def notifyEvent(self, **kwargs):
         for client in self.clients:
             client.sendMessage(**kwargs)
 
+    def cached(self, key, build):
+        """Return build(), computing it at most once per tick for key.
+
+        This lets many clients share the same piece of work (like an
+        encoded monitor frame) instead of repeating it for each of them.
+        """
+        try:
+            return self.tick_cache[key]
+        except KeyError:
+            value = self.tick_cache[key] = build()
+            return value
+
+    def record(self, kind, **fields):
+        """Logs an input from outside the game, if it is being recorded."""
+        if self.inputs is not None:
+            self.inputs.add(kind, **fields)
+
+    def new_id(self):
+        return next(self.ids)
+
+    def destroy_body(self, body):
+        self.world.DestroyBody(body)
+        self.bodies_changed()
+
+    def bodies_changed(self):
+        # whatever was built from the bodies this tick is out of date
+        self.tick_cache = {}
+
+    def get_bodies(self):
+        """The active bodies, the others are projectiles waiting for reuse."""
+        return self.cached('bodies',
+            lambda: [body for body in self.world.bodies if body.active])
+
+    def get_snapshot(self):
+        """Monitor data for every body, keyed by object id.
+
+        The snapshot is taken at most once per tick, and the ones from the
+        last keep_snapshots ticks are kept in self.snapshots so they can
+        be diffed against.
+        """
+        return self.cached('snapshot', self._take_snapshot)
+
+    def _take_snapshot(self):
+        snapshot = OrderedDict()
+        for body in self.get_bodies():
+            obj = body.userData
+            snapshot[obj.get_id()] = dict(
+                object_type=obj.get_type(), **obj.get_monitor_data())
+        self.snapshots[self.ticks] = snapshot
+        for tick in self.snapshots.keys():
+            if tick <= self.ticks - self.keep_snapshots:
+                del self.snapshots[tick]
+        return snapshot
+
+    def get_proximity_grid(self, cell_size):
+        """A grid of every body, built at most once per tick."""
+        return self.cached(('proximity grid', cell_size),
+            lambda: spatial.ProximityGrid.from_bodies(self.get_bodies(),
+                self.xsize, self.ysize, cell_size))
+
+    def get_shape_index(self):
+        """The shapes of every body, gathered at most once per tick."""
+        return self.cached('shape index',
+            lambda: spatial.ShapeIndex.from_bodies(self.get_bodies()))
+
+    def timed(self, phase, func, *args):
+        """Calls func, accounting the time it takes to phase in the stats."""
+        if self.stats is None:
+            return func(*args)
+        start = default_timer()
+        try:
+            return func(*args)
+        finally:
+            self.stats.add(phase, default_timer() - start)
+
     def doStep(self):
+        stats = self.stats
+        if stats is not None:
+            stats.start_tick()
+        if self.budget is not None:
+            started = default_timer()
+        self.ticks += 1
+        self.tick_cache = {}
+        # everything clients get this tick goes out in one write at the end
+        for client in self.clients:
+            client.hold()
         if self.status is STATUS_RUNNING:
             for object in self.objects:
                 object.execute()
+            self.projectiles.execute()
+            if stats is not None:
+                stats.lap('execute')
             self.step_world()
             self.step += 1
         for client in self.clients:
-            client.sendUpdate()
+            if client.wantsUpdate():
+                client.sendUpdate()
+        for client in self.clients:
+            client.flush()
+        if stats is not None:
+            stats.lap('send')
+        if self.recorder is not None:
+            self.recorder.record_tick()
+        if stats is not None:
+            stats.lap('record')
+            stats.end_tick(len(self.get_bodies()), len(self.clients))
+        if self.budget is not None:
+            self.budget.end_tick(self, default_timer() - started)
+        if self.inputs is not None:
+            self.inputs.end_tick()
 
     def step_world(self):
         self.world.Step(self.timeStep, self.vel_iters, self.pos_iters)
         self.world.ClearForces()
-        contacts = []
-        for contact in self.world.contacts:
-            if not contact.touching:
-                continue
-            o1 = contact.fixtureA.body.userData
-            o2 = contact.fixtureB.body.userData
-            contacts.append((o1, o2))
-
-        for o1, o2 in contacts:
+        # what was cached has the bodies where they were before moving
+        self.tick_cache = {}
+        if self.stats is not None:
+            self.stats.lap('physics')
+        for o1, o2 in self.contact_listener.collect():
             o1.contact(o2)
             o2.contact(o1)
-        # wraparound
-        for body in self.world.bodies:
-            x, y = body.position
-            body.position = (x % self.xsize), (y % self.ysize)
+        if self.stats is not None:
+            self.stats.lap('contacts')
+        self.wraparound.step()
+        # and bodies that left the map just moved again
+        self.tick_cache = {}
+        if self.stats is not None:
+            self.stats.lap('wraparound')
 
     def get_map_description(self):
         return dict(xsize=self.xsize, ysize=self.ysize,
             terrain=[x.get_description() for x in self.terrain])
 
     def register_client(self, client):
-        self.clients.append(client)
+        self.clients.add(client)
 
     def register_client_name(self, client, name):
         if name in self.taken_names:
@@ -138,22 +331,21 @@ class Game(service.Service):
                 if name not in self.taken_names:
                     break
         client.name = name  # we override the name
-        self.taken_names.append(name)
+        self.taken_names.add(name)
 
     def unregister_client(self, client):
-        if client in self.clients:
-            self.clients.remove(client)
+        self.clients.discard(client)
 
     def register_object(self, obj):
-        self.objects.append(obj)
+        self.objects.add(obj)
 
     def unregister_object(self, obj):
-        if obj in self.objects:
-            self.objects.remove(obj)
+        self.objects.discard(obj)
 
     def register_player(self, obj):
+        self.record("join", id=obj.get_id())
         self.register_object(obj)
-        self.players.append(obj)
+        self.players.add(obj)
         self.notifyEvent(type="player_joined", id=obj.get_id())
 
     def register_wall(self, obj):
@@ -161,30 +353,79 @@ class Game(service.Service):
 
     def unregister_player(self, obj):
         self.unregister_object(obj)
-        if obj in self.players:
-            self.players.remove(obj)
+        if self.players.discard(obj):
             self.players_results.append((obj.frags, obj.hits, obj.name))
         self.notifyEvent(type="player_died", id=obj.get_id())
         if len(self.players) == 1:
             self.notifyEvent(type="player_won", id=self.players[0].get_id())
             self.finish_game(self.players[0])
 
-    def get_result_table(self):
+    def get_results(self):
+        """(frags, hits, name) for every player that took part, best first.
+
+        Players still alive are included, so this also works for games
+        that were stopped before anybody won.
+        """
         results = self.players_results[:]
-        results.append((self.winner.frags, self.winner.hits, self.winner.name))
+        results.extend((player.frags, player.hits, player.name)
+            for player in self.players)
         results.sort(reverse=True)
+        return results
+
+    def get_result_table(self):
         msgs = []
-        for frags, hits, name in results:
+        for frags, hits, name in self.get_results():
             msgs.append('%s: %i frags, %i hits' % (name, frags, hits))
         return msgs
 
 
+class ContactListener(b2.contactListener):
+    """Gathers the pairs of objects that started touching during a step.
+
+    Box2D tells about them as they happen, so contacts that go on from
+    previous steps aren't looked at again. Pairs where neither object
+    reacts to contacts (like a player against a wall) are left out.
+    """
+
+    def __init__(self):
+        b2.contactListener.__init__(self)
+        self.pairs = []
+        # class -> whether it overrides ObjectBase.contact
+        self.reactive = {}
+
+    def reacts(self, cls):
+        try:
+            return self.reactive[cls]
+        except KeyError:
+            value = self.reactive[cls] = \
+                cls.contact.__func__ is not ObjectBase.contact.__func__
+            return value
+
+    def BeginContact(self, contact):
+        o1 = contact.fixtureA.body.userData
+        o2 = contact.fixtureB.body.userData
+        if self.reacts(type(o1)) or self.reacts(type(o2)):
+            self.pairs.append((o1, o2))
+
+    def collect(self):
+        """The pairs gathered since the last call."""
+        pairs, self.pairs = self.pairs, []
+        return pairs
+
+
 class ObjectBase(object):
     name = "unknown"
+    # the collision category of its fixtures, and the categories it
+    # collides with. Box2D doesn't even look at pairs that don't. Objects
+    # without a category of their own count as any of them.
+    category = CATEGORY_ALL
+    mask = CATEGORY_ALL
 
     def __init__(self, map, x=None, y=None):
         self.map = map
+        self.id = map.new_id()
         self.create_body(x, y)
+        map.wraparound.watch(self)
 
     def create_body(self, x, y):
         raise NotImplementedError()
@@ -193,14 +434,22 @@ class ObjectBase(object):
         return "object"
 
     def get_id(self):
-        return id(self)
+        return self.id
 
     def get_full_position(self):
-        """This returns our full position."""
+        """This returns our full position.
+
+        It is read from the body once per tick and shared by everybody
+        asking during that tick, so don't change it.
+        """
+        return self.map.cached((self.id, 'position'), self.read_position)
+
+    def read_position(self):
+        body = self.body
         return dict(
-            position=tuple(self.body.position),
-            angle=self.body.angle,
-            velocity=tuple(self.body.linearVelocity))
+            position=tuple(body.position),
+            angle=body.angle,
+            velocity=tuple(body.linearVelocity))
 
     def get_monitor_data(self):
         """This returns all the data there is to return."""
@@ -208,7 +457,7 @@ class ObjectBase(object):
 
     def destroy(self):
         if self.body is not None:
-            self.map.world.DestroyBody(self.body)
+            self.map.destroy_body(self.body)
             self.body = None
 
     def contact(self, other):
@@ -217,18 +466,20 @@ class ObjectBase(object):
 
 class PowerUp(ObjectBase):
     radius = 1
+    category = CATEGORY_POWERUP
 
     def get_type(self):
         return "powerup"
 
     def create_body(self, x=None, y=None):
         if x is None:
-            x = random.random() * self.map.xsize
+            x = self.map.random.random() * self.map.xsize
         if y is None:
-            y = random.random() * self.map.ysize
+            y = self.map.random.random() * self.map.ysize
         self.body = self.map.world.CreateDynamicBody(position=(x, y),
                                                 userData=self)
-        self.body.CreateCircleFixture(radius=self.radius, density=1)
+        self.body.CreateCircleFixture(radius=self.radius, density=1,
+            categoryBits=self.category, maskBits=self.mask)
 
     def contact(self, other):
         self.destroy()
@@ -274,8 +525,8 @@ class RapidFirePowerUp(PowerUp):
 class RapidFirePowerUpRespawn(RapidFirePowerUp):
     def contact(self, other):
         super(RapidFirePowerUp, self).contact(other)
-        self.__class__(self.map, self.map.xsize * random.random(),
-                self.map.ysize * random.random())
+        self.__class__(self.map, self.map.xsize * self.map.random.random(),
+                self.map.ysize * self.map.random.random())
 
 
 
@@ -306,10 +557,10 @@ class ProximityMine(PowerUp):
     def contact(self, other):
         x, y = self.body.position
         for n in range(self.bullets):
-            velocity = random.randint(self.min_speed, self.max_speed)
-            angle = euclid.Matrix3.new_rotate(2 * math.pi * random.random())
-            speedx, speedy = angle * euclid.Vector2(velocity, 0)
-            Shrapnel(self.map, x, y, speedx, speedy)
+            velocity = self.map.random.randint(self.min_speed, self.max_speed)
+            speedx, speedy = vectors.polar(velocity,
+                2 * math.pi * self.map.random.random())
+            self.map.projectiles.spawn(Shrapnel, x, y, speedx, speedy)
         super(ProximityMine, self).contact(other)
 
 
@@ -320,7 +571,8 @@ class GpsSensor(object):
         self.player = player
 
     def getReadings(self):
-        return self.player.get_full_position()
+        # a copy, bots are free to change what they get
+        return dict(self.player.get_full_position())
 
 
 class StatusSensor(object):
@@ -336,23 +588,7 @@ class StatusSensor(object):
             )
 
 
-def distance(p1, p2):
-    return abs(euclid.Point2(*p1) - euclid.Point2(*p2))
-
-
-class ProximitySensorCallback(Box2D.b2QueryCallback):
-    def __init__(self, center, radius):
-        self.result = []
-        self.center = center
-        self.radius = radius
-        Box2D.b2QueryCallback.__init__(self)
-
-    def ReportFixture(self, fixture):
-        body = fixture.body
-        if distance(self.center, body.position) < self.radius:
-            self.result.append(body.userData)
-        # Continue the query by returning True
-        return True
+distance = vectors.distance
 
 
 class ProximitySensor(object):
@@ -363,42 +599,17 @@ class ProximitySensor(object):
         self.player = player
 
     def getReadings(self):
-        p = self.player.body.position
-        aabb = Box2D.b2AABB(
-            lowerBound=p - (self.radius, self.radius),
-            upperBound=p + (self.radius, self.radius))
-
-        # Query the world for overlapping shapes.
-        query = ProximitySensorCallback(p, self.radius)
-        self.player.map.world.QueryAABB(query, aabb)
+        # all players share the same grid, built once per tick
+        grid = self.player.map.get_proximity_grid(self.radius)
         return [dict(
                 object_type=result.get_type(),
                 id=result.get_id(),
                 **result.get_full_position())
-                for result in query.result
+                for result in grid.query(self.player.body.position,
+                    self.radius)
                 if result is not self.player]
 
 
-class RayCastCallback(Box2D.b2RayCastCallback):
-    """
-    This class captures the closest hit shape.
-    """
-    def __init__(self):
-        super(RayCastCallback, self).__init__()
-        self.fixture = None
-
-    # Called for each fixture found in the query. You control how the ray
-    # proceeds by returning a float that indicates the fractional length of
-    # the ray. By returning 0, you set the ray length to zero. By returning
-    # the current fraction, you proceed to find the closest point.
-    # By returning 1, you continue with the original ray clipping.
-    def ReportFixture(self, fixture, point, normal, fraction):
-        self.fixture = fixture
-        self.point = Box2D.b2Vec2(point)
-        self.normal = Box2D.b2Vec2(normal)
-        return fraction
-
-
 class RadarSensor(object):
     name = 'radar'
     steps = 360
@@ -408,29 +619,21 @@ class RadarSensor(object):
         self.player = player
 
     def getReadings(self):
-        ray = euclid.Vector2(self.distance, 0)
-        rotate = euclid.Matrix3.new_rotate(2 * math.pi / self.steps)
-
-        readings = {}
-        for step in range(self.steps):
-            callback = RayCastCallback()
-
-            point1 = self.player.body.position
-            point2 = tuple(ray + self.player.body.position)
-            ray = rotate * ray
-            self.player.map.world.RayCast(callback, point1, point2)
-            if callback.fixture is not None:
-                object_id = callback.fixture.body.userData.get_id()
-                readings[object_id] = dict(
-                    object_type=callback.fixture.body.userData.get_type(),
-                    id=object_id,
-                    **callback.fixture.body.userData.get_full_position())
-        return readings.values()
+        # every ray is cast at once against the shapes of the whole world
+        shapes = self.player.map.get_shape_index()
+        hits = shapes.cast(tuple(self.player.body.position),
+            spatial.ray_directions(self.steps), self.distance)
+        return [dict(
+                object_type=result.get_type(),
+                id=result.get_id(),
+                **result.get_full_position())
+                for result in hits]
 
 
 class PlayerObject(ObjectBase):
     # the maximum possible force from the engines in newtons
     max_force = 300
+    category = CATEGORY_PLAYER
     # the maximum instant turn per step, in radians
     max_turn = math.pi / 8
     # number of steps that it takes for weapon to reload
@@ -451,6 +654,7 @@ class PlayerObject(ObjectBase):
         self.current_throttle = 0  # Current value
         self.hits = 0
         self.frags = 0
+        self.heading = vectors.Heading()
 
     def compute_hit(self, victim):
         if self is not victim:
@@ -460,17 +664,15 @@ class PlayerObject(ObjectBase):
         if self is not victim:
             self.frags += 1
 
-    def get_full_position(self):
-        result = super(PlayerObject, self).get_full_position()
+    def read_position(self):
+        result = super(PlayerObject, self).read_position()
         if hasattr(self, 'name'):
             result['name'] = self.name
         return result
 
     def get_monitor_data(self):
-        result = self.get_full_position()
-        result['throttle'] = self.current_throttle
-        result['health'] = self.health
-        return result
+        return dict(self.get_full_position(),
+            throttle=self.current_throttle, health=self.health)
 
     def execute(self):
         body = self.body
@@ -481,28 +683,28 @@ class PlayerObject(ObjectBase):
                 self.turn) % (2 * math.pi)
             self.turn = 0
         self.current_throttle = self.throttle
+        heading = self.heading
+        heading.update(body.angle)
         if self.throttle != 0:
-            force = euclid.Matrix3.new_rotate(body.angle) * \
-                    euclid.Vector2(1, 0) * self.max_force * \
-                    self.throttle
-            body.ApplyForce(tuple(force), body.position)
+            force = heading.forward(self.max_force * self.throttle)
+            body.ApplyForce(force, body.position)
             self.throttle = 0
         if self.reloading:
             self.reloading -= 1
         else:
             if self.fire:
-                x, y = euclid.Matrix3.new_rotate(body.angle) * \
-                    euclid.Vector2(4, 0) + body.position
-                speedx, speedy = euclid.Matrix3.new_rotate(body.angle) * \
-                    euclid.Vector2(135, 0) + body.linearVelocity
-                Bullet(self.map, x, y, speedx, speedy, shooter=self)
+                x, y = body.position
+                dx, dy = heading.forward(4)
+                speedx, speedy = body.linearVelocity
+                vx, vy = heading.forward(135)
+                self.map.projectiles.spawn(Bullet, x + dx, y + dy,
+                    speedx + vx, speedy + vy, shooter=self)
                 self.reloading = self.reload_delay
                 self.fire = 0
 
                 # pushback
-                force = euclid.Matrix3.new_rotate(body.angle) * \
-                    euclid.Vector2(-1, 0) * self.max_force * 3
-                body.ApplyForce(tuple(force), body.position)
+                force = heading.forward(-self.max_force * 3)
+                body.ApplyForce(force, body.position)
 
         self.run_callbacks()
 
@@ -524,12 +726,13 @@ class PlayerObject(ObjectBase):
 
     def create_body(self, x=None, y=None):
         if x is None:
-            x = random.random() * self.map.xsize
+            x = self.map.random.random() * self.map.xsize
         if y is None:
-            y = random.random() * self.map.ysize
+            y = self.map.random.random() * self.map.ysize
         self.body = self.map.world.CreateDynamicBody(position=(x, y),
                                                 userData=self)
-        self.body.CreateCircleFixture(radius=2, density=1)
+        self.body.CreateCircleFixture(radius=2, density=1,
+            categoryBits=self.category, maskBits=self.mask)
 
     def destroy(self):
         if self.body is not None:
@@ -555,35 +758,43 @@ class PlayerObject(ObjectBase):
 class Bullet(ObjectBase):
     total_ttl = 100
     damage = 10
+    category = CATEGORY_BULLET
 
-    def __init__(self, map, x, y, speedx=None, speedy=None, shooter=None):
+    def __init__(self, map, slot):
+        """Use map.projectiles.spawn to fire one, they are reused."""
         self.map = map
-        self.shooter = shooter
-        self.ttl = self.total_ttl
-        self.create_body(x, y, speedx, speedy)
-        self.map.register_object(self)
+        self.slot = slot
+        self.id = None
+        self.body = None
 
-    def execute(self):
-        self.ttl -= 1
-        if self.ttl <= 0:
-            self.destroy()
+    @property
+    def shooter(self):
+        return self.map.projectiles.shooters[self.slot]
+
+    @property
+    def ttl(self):
+        return self.map.projectiles.ttl[self.slot]
 
     def get_type(self):
         return "bullet"
 
-    def create_body(self, x, y, speedx=None, speedy=None):
-        if speedx is None:
-            speedx = random.random() * self.map.xsize
-        if speedy is None:
-            speedy = random.random() * self.map.ysize
-        self.body = self.map.world.CreateDynamicBody(position=(x, y),
-                                                userData=self, bullet=True)
-        self.body.CreateCircleFixture(radius=1, density=1)
+    def create_body(self, x, y, speedx, speedy):
+        if self.body is None:
+            self.body = self.map.world.CreateDynamicBody(position=(x, y),
+                                                    userData=self, bullet=True)
+            self.body.CreateCircleFixture(radius=1, density=1,
+                categoryBits=self.category, maskBits=self.mask)
+        else:
+            body = self.body
+            body.position = x, y
+            body.angle = 0
+            body.angularVelocity = 0
+            body.active = True
         self.body.linearVelocity = speedx, speedy
 
     def contact(self, other):
         if isinstance(other, PlayerObject):
-            shooter = getattr(self, 'shooter', None)
+            shooter = self.shooter
             callbacks = {}
             if shooter:
                 callbacks['callback_hit'] = lambda: shooter.compute_hit(other)
@@ -593,12 +804,13 @@ class Bullet(ObjectBase):
         super(Bullet, self).contact(other)
 
     def destroy(self):
-        self.map.unregister_object(self)
-        super(Bullet, self).destroy()
+        self.map.projectiles.release(self)
 
 
 class Shrapnel(Bullet):
-    """Like a Bullet, but doesn't disappear in contact with another Shrapnel"""
+    """Like a Bullet, but goes through other Shrapnel"""
+    category = CATEGORY_SHRAPNEL
+    mask = CATEGORY_ALL & ~CATEGORY_SHRAPNEL
 
     def contact(self, other):
         if isinstance(other, PlayerObject):
@@ -606,3 +818,136 @@ class Shrapnel(Bullet):
         if not isinstance(other, Shrapnel):
             self.destroy()
         super(Bullet, self).contact(other)
+
+
+class Projectiles(object):
+    """Every Bullet and Shrapnel in a game.
+
+    A projectile that goes away keeps its body, deactivated, and hands it
+    to the next projectile of its class. Their ttl and shooter live in
+    arrays indexed by slot, so aging all of them is one array operation
+    per tick. Slots freed in a tick are only reused from the next one, so
+    that a contact of the current tick never reaches a new projectile.
+    """
+
+    def __init__(self, map, size=64):
+        self.map = map
+        self.handles = [None] * size
+        self.shooters = [None] * size
+        self.ttl = numpy.zeros(size, dtype=int)
+        self.alive = numpy.zeros(size, dtype=bool)
+        self.used = 0
+        # class -> slots ready to be reused
+        self.free = {}
+        self.released = []
+
+    def spawn(self, cls, x, y, speedx=None, speedy=None, shooter=None):
+        """Fires a projectile of cls, returns it."""
+        if speedx is None:
+            speedx = self.map.random.random() * self.map.xsize
+        if speedy is None:
+            speedy = self.map.random.random() * self.map.ysize
+        free = self.free.get(cls)
+        if free:
+            slot = free.pop()
+            projectile = self.handles[slot]
+        else:
+            slot = self.allocate()
+            projectile = self.handles[slot] = cls(self.map, slot)
+        projectile.id = self.map.new_id()
+        self.ttl[slot] = cls.total_ttl
+        self.alive[slot] = True
+        self.shooters[slot] = shooter
+        projectile.create_body(x, y, speedx, speedy)
+        self.map.wraparound.watch(projectile)
+        self.map.bodies_changed()
+        return projectile
+
+    def allocate(self):
+        slot = self.used
+        size = len(self.ttl)
+        if slot == size:
+            self.handles.extend([None] * size)
+            self.shooters.extend([None] * size)
+            self.ttl = numpy.concatenate((self.ttl, numpy.zeros_like(self.ttl)))
+            self.alive = numpy.concatenate((self.alive,
+                numpy.zeros_like(self.alive)))
+        self.used += 1
+        return slot
+
+    def release(self, projectile):
+        slot = projectile.slot
+        if not self.alive[slot]:
+            return
+        self.alive[slot] = False
+        self.shooters[slot] = None
+        projectile.body.active = False
+        self.released.append(slot)
+        self.map.bodies_changed()
+
+    def execute(self):
+        for slot in self.released:
+            self.free.setdefault(type(self.handles[slot]), []).append(slot)
+        self.released = []
+        alive = self.alive
+        self.ttl[alive] -= 1
+        for slot in numpy.nonzero(alive & (self.ttl <= 0))[0]:
+            self.release(self.handles[slot])
+
+    def __iter__(self):
+        return iter([self.handles[slot]
+            for slot in numpy.nonzero(self.alive)[0]])
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+
+class Wraparound(object):
+    """Keeps bodies inside the map, looking only at those that may be out.
+
+    No body moves more than b2_maxTranslation in a step, so one that is
+    some distance away from every edge can't cross any for the next
+    distance / b2_maxTranslation steps, and is only looked at again then.
+    Bodies are watched from when they are created or moved by hand; static
+    ones never move and are never looked at.
+    """
+
+    def __init__(self, map):
+        self.map = map
+        self.steps = 0
+        # step -> objects to look at after it
+        self.due = {}
+        # object -> the step it's due, entries elsewhere in due are stale
+        self.next_step = {}
+
+    def watch(self, obj):
+        """Looks at obj after the next step."""
+        if obj.body.type == b2.staticBody:
+            return
+        self.schedule(obj, 1)
+
+    def schedule(self, obj, steps):
+        step = self.steps + steps
+        self.next_step[obj] = step
+        self.due.setdefault(step, []).append(obj)
+
+    def step(self):
+        self.steps += 1
+        xsize = self.map.xsize
+        ysize = self.map.ysize
+        for obj in self.due.pop(self.steps, ()):
+            if self.next_step.get(obj) != self.steps:
+                continue
+            body = obj.body
+            # destroyed or waiting for reuse, they are watched again if
+            # they come back
+            if body is None or not body.active:
+                del self.next_step[obj]
+                continue
+            x, y = body.position
+            if not (0 <= x < xsize and 0 <= y < ysize):
+                x %= xsize
+                y %= ysize
+                body.position = x, y
+            margin = min(x, xsize - x, y, ysize - y)
+            self.schedule(obj, max(1, int(margin / b2.maxTranslation)))
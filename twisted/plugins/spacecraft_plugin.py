@@ -5,6 +5,7 @@ from twisted.plugin import IPlugin
 from twisted.application.service import IServiceMaker
 
 import spacecraft
+import spacecraft.replay
 
 
 class SpaceCraftServiceMaker(object):
@@ -19,3 +20,16 @@ class SpaceCraftServiceMaker(object):
 
 
 serviceMaker = SpaceCraftServiceMaker()
+
+
+class ReplayServiceMaker(object):
+    implements(IServiceMaker, IPlugin)
+    tapname = "spacecraft-replay"
+    description = "Plays recorded games to monitors."
+    options = spacecraft.replay.Options
+
+    def makeService(self, options):
+        return spacecraft.replay.makeService(options)
+
+
+replayServiceMaker = ReplayServiceMaker()